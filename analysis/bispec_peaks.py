@@ -5,22 +5,54 @@ Utilities to extract bicoherence peaks and estimate dominant mode frequencies.
 from __future__ import annotations
 import numpy as np
 from numpy.fft import rfft, rfftfreq
+from analysis.bispectrum import SegmentSpectra
 
-def dominant_freq(sig: np.ndarray, fs: float, nmax: int = 3):
-    """Return top-nmax peak frequencies from magnitude spectrum (rough)."""
-    sig = np.asarray(sig, dtype=float)
-    F = rfft(sig * np.hanning(len(sig)))
-    mag = np.abs(F)
-    f = rfftfreq(len(sig), 1.0/fs)
+def dominant_freq(sig, fs: float = None, nmax: int = 3):
+    """
+    Return top-nmax peak frequencies from magnitude spectrum (rough).
+    sig may be a SegmentSpectra, in which case its segment-averaged magnitude is used.
+    """
+    if isinstance(sig, SegmentSpectra):
+        mag = sig.magnitude()
+        f = sig.f
+    else:
+        sig = np.asarray(sig, dtype=float)
+        F = rfft(sig * np.hanning(len(sig)))
+        mag = np.abs(F)
+        f = rfftfreq(len(sig), 1.0/fs)
     # ignore DC
     mag[0] = 0.0
     idx = np.argsort(mag)[::-1][:nmax]
     return f[idx], mag[idx]
 
-def find_bicoherence_peak(b2: np.ndarray, f: np.ndarray):
-    """Return peak location and value in bicoherence matrix."""
+def bifrequency_axes(f):
+    """Split f into (f1_axis, f2_axis); f is a shared 1-D axis or an ROI pair."""
+    if isinstance(f, tuple):
+        return np.asarray(f[0]), np.asarray(f[1])
+    f = np.asarray(f)
+    return f, f
+
+def find_bicoherence_peak(b2: np.ndarray, f):
+    """
+    Return peak location and value in bicoherence matrix (i, j index into b2).
+    b2 may be dense or a PackedBispectrum; the latter is searched without expanding.
+    """
+    f1_axis, f2_axis = bifrequency_axes(f)
     idx = np.unravel_index(np.argmax(b2), b2.shape)
     i, j = int(idx[0]), int(idx[1])
-    f1, f2 = float(f[i]), float(f[j])
-    val = float(b2[i,j])
+    f1, f2 = float(f1_axis[i]), float(f2_axis[j])
+    val = float(np.max(b2))
     return {"f1": f1, "f2": f2, "b2_peak": val, "i": i, "j": j}
+
+def peak_trajectory(b2_t: np.ndarray, f):
+    """
+    Per-window peak of a sliding bicoherence stack b2_t (n_windows, ...) from
+    sliding_bicoherence. f is a (P, 2) array of pair frequencies or the axes
+    accepted by find_bicoherence_peak. Returns arrays f1, f2, b2_peak.
+    """
+    b2_t = np.asarray(b2_t)
+    if b2_t.ndim == 2 and not isinstance(f, tuple) and np.ndim(f) == 2:
+        n = np.argmax(b2_t, axis=1)
+        return f[n, 0], f[n, 1], b2_t[np.arange(len(n)), n]
+    peaks = [find_bicoherence_peak(b2, f) for b2 in b2_t]
+    return tuple(np.array([p[k] for p in peaks]) for k in ("f1", "f2", "b2_peak"))
@@ -0,0 +1,212 @@
+"""
+analysis/bispec_plan.py
+Memory/FLOP preflight for segment-averaged bispectrum jobs.
+
+plan_bispectrum() estimates, from the job settings alone, the peak RAM of
+bispectrum()/cross_bispectrum() (segment spectra, engine copies, index grids,
+S3/S2 planes, gather blocks) and the floating-point work, without allocating
+anything. preflight() checks a plan against a memory budget and either refuses
+(MemoryError) or downgrades the job: packed storage first, then .npy memmaps
+for the planes, then a shrinking f1/f2 region of interest.
+"""
+from __future__ import annotations
+import os
+from typing import Optional, Tuple
+
+import numpy as np
+from numpy.fft import rfftfreq
+
+from analysis.bispectrum import _band, _BLOCK_ELEMS
+
+_REAL_BYTES = {"float64": 8, "float32": 4}
+# flops per segment per bin: complex triple product and sum, plus the magnitude product
+_FLOPS_PER_BIN = 17
+
+
+def available_memory() -> Optional[int]:
+    """
+    Bytes of RAM currently available, or None if the platform does not say.
+    Linux MemAvailable counts reclaimable page cache; MemFree (SC_AVPHYS_PAGES) is the fallback.
+    """
+    try:
+        with open("/proc/meminfo") as fh:
+            for line in fh:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def default_budget(fraction: float = 0.8) -> Optional[int]:
+    """fraction of available RAM; TRIALITY_MEM_BUDGET (GB) overrides."""
+    env = os.environ.get("TRIALITY_MEM_BUDGET")
+    if env:
+        return int(float(env) * 2**30)
+    avail = available_memory()
+    return None if avail is None else int(fraction * avail)
+
+
+def _plane_bins(nF, rows, cols, packed, symmetric):
+    r0, r1 = rows if rows is not None else (0, nF)
+    c0, c1 = cols if cols is not None else (0, nF)
+    if not packed:
+        return (r1 - r0) * (c1 - c0)
+    ii = np.arange(r0, r1)
+    hi = np.minimum(c1, nF - ii)
+    if symmetric:
+        hi = np.minimum(hi, ii + 1)
+    return int(np.maximum(hi - c0, 0).sum())
+
+
+def plan_bispectrum(n_samples: int, seglen: int, step: Optional[int] = None, channels: int = 3,
+                    fs: float = 1.0, f1_range: Optional[Tuple[float, float]] = None,
+                    f2_range: Optional[Tuple[float, float]] = None, packed: bool = False,
+                    memmap: bool = False, precision: str = "float64", workers: Optional[int] = None,
+                    batch: int = 0, lines: Optional[int] = None):
+    """
+    Estimate the footprint of one bispectrum (channels=1) or cross-bispectrum
+    (channels=3) call. Returns a dict with nseg, nF, bins, ram_bytes, disk_bytes
+    (memmapped planes) and flops; nothing is allocated.
+    lines=L plans a sum-line slice (L lines of nF bins, never packed or memmapped)
+    instead of the plane; batch=B adds B surrogate triples held at once by
+    batch_max_bicoherence (records, segment spectra and their copies).
+    """
+    if precision not in _REAL_BYTES:
+        raise ValueError(f"Unknown precision: {precision!r} (use 'float64' or 'float32').")
+    step = seglen // 2 if step is None else step
+    r = _REAL_BYTES[precision]
+    c = 2 * r
+    nseg = 0 if n_samples < seglen else 1 + (n_samples - seglen) // step
+    nF = seglen // 2 + 1
+    f = rfftfreq(seglen, d=1.0 / fs)
+    rows, cols = _band(f, f1_range), _band(f, f2_range)
+    symmetric = channels == 1 and rows == cols
+    if lines is not None:
+        packed = memmap = False
+        bins = lines * nF
+    else:
+        bins = _plane_bins(nF, rows, cols, packed, symmetric)
+
+    spec = nseg * nF
+    spectra = channels * spec * c              # SegmentSpectra.F per channel
+    engine = 3 * spec * (c + r)                # conj copy and magnitudes in _triple_sums
+    index = bins * (3 * 4 + 1) if packed else bins * (8 + 1)
+    planes = bins * (c + r)                    # S3 and S2 (b2 reuses S2's buffer)
+    # per worker: one segment block of gathered products (dense tiles broadcast i/j and
+    # only gather the full k grid; packed pairs gather all three)
+    gather = max(1, workers or 1) * (3 if packed else 1) * min(_BLOCK_ELEMS, nseg * bins) * c
+    ram = spectra + engine + index + gather + (0 if memmap else planes)
+    if batch:
+        # per triple: three records, their spectra held twice (rfft output and the
+        # transposed copy) plus magnitudes, and one channel's windowed segments in flight;
+        # the tiles gather three complex operands of at most one block each
+        ram += batch * (3 * (n_samples * r + spec * (2 * c + r)) + nseg * seglen * r)
+        ram += 3 * min(_BLOCK_ELEMS, batch * nseg * bins) * c
+    fft = (channels + 3 * batch) * nseg * 5 * seglen * np.log2(max(seglen, 2))
+    return {
+        "nseg": nseg,
+        "nF": nF,
+        "bins": bins,
+        "ram_bytes": int(ram),
+        "disk_bytes": int(planes if memmap else 0),
+        "flops": float(_FLOPS_PER_BIN * nseg * bins * (1 + batch) + fft),
+        "packed": packed,
+        "memmap": memmap,
+        "f1_range": f1_range,
+        "f2_range": f2_range,
+        "precision": precision,
+    }
+
+
+def _shrink(fs, f1_range, f2_range, scale):
+    lo1, hi1 = f1_range if f1_range is not None else (0.0, fs / 2)
+    lo2, hi2 = f2_range if f2_range is not None else (0.0, fs / 2)
+    return (lo1, float(lo1 + (hi1 - lo1) * scale)), (lo2, float(lo2 + (hi2 - lo2) * scale))
+
+
+def preflight(n_samples: int, seglen: int, budget: Optional[int] = None, on_over: str = "downgrade",
+              allow_roi: bool = True, **settings):
+    """
+    Plan a job and fit it into budget bytes (default: default_budget()). Returns the
+    (possibly downgraded) plan; its packed/memmap/f1_range/f2_range are the settings to
+    run with. on_over="refuse" raises MemoryError instead of downgrading. The ROI step
+    keeps the lower band edges and shrinks both ranges until the plan fits.
+    """
+    if on_over not in ("downgrade", "refuse"):
+        raise ValueError(f"Unknown on_over: {on_over!r} (use 'downgrade' or 'refuse').")
+    budget = default_budget() if budget is None else budget
+    plan = plan_bispectrum(n_samples, seglen, **settings)
+    if budget is None or plan["ram_bytes"] <= budget:
+        return plan
+    if on_over == "refuse":
+        raise MemoryError(f"Bispectrum needs ~{plan['ram_bytes']/2**30:.3f} GB, "
+                          f"over the {budget/2**30:.3f} GB budget.")
+    # packed halves the plane but gathers three operands per block, so every
+    # combination is tried and the cheapest kept for the message on failure
+    for extra in ({"packed": True}, {"memmap": True}, {"packed": True, "memmap": True}):
+        trial = plan_bispectrum(n_samples, seglen, **dict(settings, **extra))
+        if trial["ram_bytes"] <= budget:
+            return trial
+        plan = min(plan, trial, key=lambda p: p["ram_bytes"])
+    if allow_roi:
+        fs = settings.get("fs", 1.0)
+        f1_range, f2_range = settings.get("f1_range"), settings.get("f2_range")
+        settings["memmap"] = True
+        for scale in 0.5 ** np.arange(1, 12):
+            settings["f1_range"], settings["f2_range"] = _shrink(fs, f1_range, f2_range, scale)
+            try:
+                trials = [plan_bispectrum(n_samples, seglen, **dict(settings, packed=p)) for p in (False, True)]
+            except ValueError:
+                break                          # ROI narrower than one bin
+            plan = min(trials, key=lambda p: p["ram_bytes"])
+            if plan["ram_bytes"] <= budget:
+                return plan
+    raise MemoryError(f"Bispectrum needs ~{plan['ram_bytes']/2**30:.3f} GB even after downgrading, "
+                      f"over the {budget/2**30:.3f} GB budget.")
+
+
+def preflight_batch(n_samples: int, seglen: int, chunk: int, processes: Optional[int] = None,
+                    budget: Optional[int] = None, on_over: str = "downgrade", **settings):
+    """
+    preflight() for a data bispectrum plus surrogate chunks of chunk triples on
+    processes workers. Over budget the chunk is halved first (surrogate values do not
+    depend on it), then the plane is downgraded as in preflight(). Returns (plan, chunk).
+    """
+    budget = default_budget() if budget is None else budget
+    inflight = max(1, processes or 1)
+    while chunk > 1 and on_over == "downgrade":
+        try:
+            return preflight(n_samples, seglen, budget=budget, on_over="refuse",
+                             batch=chunk * inflight, **settings), chunk
+        except MemoryError:
+            chunk //= 2
+    return preflight(n_samples, seglen, budget=budget, on_over=on_over, batch=chunk * inflight,
+                     **settings), chunk
+
+
+def add_precision_arg(ap):
+    """--precision flag shared by the bispectrum CLIs."""
+    ap.add_argument("--precision", choices=("float64", "float32"), default="float64",
+                    help="float32 keeps samples, spectra and sums in float32/complex64")
+
+
+def add_budget_args(ap):
+    """--mem-budget/--on-over-budget/--memmap flags shared by the bispectrum CLIs."""
+    ap.add_argument("--mem-budget", type=float, default=None,
+                    help="RAM budget in GB (default: TRIALITY_MEM_BUDGET or 80%% of available RAM)")
+    ap.add_argument("--on-over-budget", choices=("downgrade", "refuse"), default="downgrade",
+                    help="over budget: fall back to packed/memmap/narrower ROI, or stop")
+    ap.add_argument("--memmap", action="store_true",
+                    help="write S3/b2 straight to .npy memmaps in the output dir")
+
+
+def describe(plan) -> str:
+    """One-line summary for CLI logs."""
+    return (f"nseg={plan['nseg']} bins={plan['bins']} ram~{plan['ram_bytes']/2**30:.3f} GB "
+            f"disk~{plan['disk_bytes']/2**30:.3f} GB flops~{plan['flops']:.3g} "
+            f"packed={plan['packed']} memmap={plan['memmap']} "
+            f"f1_range={plan['f1_range']} f2_range={plan['f2_range']}")
@@ -3,61 +3,675 @@ analysis/bispectrum.py
 Bispectrum and bicoherence estimators.
 """
 from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import numpy as np
-from numpy.fft import rfft, rfftfreq
+from numpy.lib.format import open_memmap
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.fft import rfft, rfftfreq
 from typing import Optional, Tuple
 
-def _segment(data: np.ndarray, seglen: int, step: Optional[int]=None):
-    x = np.asarray(data, dtype=float)
+# Upper bound on gathered triple products held in memory per segment block.
+_BLOCK_ELEMS = 1 << 22
+# Bifrequency bins per tile; tiles are the unit of work handed to workers.
+_TILE_ELEMS = 1 << 18
+# precision name -> (real, complex) dtypes for samples, spectra and accumulators
+_PRECISION = {"float64": (np.float64, np.complex128), "float32": (np.float32, np.complex64)}
+
+def _dtypes(precision: str):
+    if precision not in _PRECISION:
+        raise ValueError(f"Unknown precision: {precision!r} (use 'float64' or 'float32').")
+    return _PRECISION[precision]
+
+def _segment(data: np.ndarray, seglen: int, step: Optional[int]=None, dtype=np.float64):
+    """(nseg, seglen) strided read-only view of data; no samples are copied."""
+    x = np.asarray(data, dtype=dtype)
     if step is None:
         step = seglen//2
-    nseg = 1 + max(0, (len(x)-seglen)//step)
-    out = np.empty((nseg, seglen), dtype=float)
-    for i in range(nseg):
-        s = i*step
-        out[i] = x[s:s+seglen]
-    return out
-
-def bispectrum(x: np.ndarray, fs: float, seglen: int, step: Optional[int]=None, detrend: bool=True):
-    x = np.asarray(x, dtype=float)
-    X = _segment(x - (x.mean() if detrend else 0.0), seglen, step)
-    win = np.hanning(seglen)[None, :]
-    F = rfft(X*win, axis=1)
-    nF = F.shape[1]
-    S3 = np.zeros((nF, nF), dtype=complex)
-    S2 = np.zeros((nF, nF), dtype=float)
-    for row in F:
-        for i in range(nF):
-            for j in range(nF):
-                k = i + j
-                if k < nF:
-                    S3[i,j] += row[i]*row[j]*np.conj(row[k])
-                    S2[i,j] += (np.abs(row[i])*np.abs(row[j])*np.abs(row[k]))
-    S3 /= F.shape[0]
-    S2 /= F.shape[0] + 1e-12
-    f = rfftfreq(seglen, d=1.0/fs)
-    b2 = (np.abs(S3)**2) / ((S2**2)+1e-20)
-    return f, S3, b2
+    return sliding_window_view(x, seglen)[::step]
+
+# index grids are plane-sized (~150 MB at seglen 8192): keep only the latest one, as
+# bispec_plan assumes; uni and cross runs on the same ROI still share it
+@lru_cache(maxsize=1)
+def _triple_index(nF: int, rows: Tuple[int, int]=None, cols: Tuple[int, int]=None):
+    """Index grids (i, j, i+j) and validity mask for a rows x cols block of the nF x nF plane."""
+    r0, r1 = rows if rows is not None else (0, nF)
+    c0, c1 = cols if cols is not None else (0, nF)
+    i = np.arange(r0, r1)[:, None]
+    j = np.arange(c0, c1)[None, :]
+    k = i + j
+    valid = k < nF
+    k = np.where(valid, k, 0)
+    for a in (i, j, k, valid):
+        a.flags.writeable = False
+    return i, j, k, valid
+
+@lru_cache(maxsize=1)
+def _pair_index(nF: int, rows: Tuple[int, int]=None, cols: Tuple[int, int]=None, symmetric: bool=False):
+    """1-D (i, j, i+j) pair lists covering the principal domain of a rows x cols block."""
+    r0, r1 = rows if rows is not None else (0, nF)
+    c0, c1 = cols if cols is not None else (0, nF)
+    ii = np.arange(r0, r1)
+    hi = np.minimum(c1, nF - ii)
+    if symmetric:
+        hi = np.minimum(hi, ii + 1)
+    counts = np.maximum(hi - c0, 0)
+    dtype = np.int32 if nF < np.iinfo(np.int32).max // 2 else np.int64
+    i = np.repeat(ii, counts).astype(dtype)
+    starts = np.cumsum(counts) - counts
+    j = (np.arange(counts.sum()) - np.repeat(starts, counts) + c0).astype(dtype)
+    k = i + j
+    valid = np.ones(i.shape, dtype=bool)
+    for a in (i, j, k, valid):
+        a.flags.writeable = False
+    return i, j, k, valid
+
+class PackedBispectrum:
+    """
+    Bispectral values on a subset of (i, j) pairs (the principal domain, or the sparse
+    candidates of peak_guided_bicoherence), stored as 1-D arrays over those pairs.
+    i/j are absolute rfft bins; shape/offset describe the dense block they expand into.
+    Supports np.asarray()/toarray(), max() and argmax() (flat index into the dense block).
+    """
+    def __init__(self, values, i, j, shape, offset=(0, 0), symmetric=False):
+        self.values = values
+        self.i = i
+        self.j = j
+        self.shape = tuple(shape)
+        self.offset = tuple(offset)
+        self.symmetric = symmetric
+
+    def __len__(self):
+        return len(self.values)
+
+    def toarray(self):
+        r0, c0 = self.offset
+        dense = np.zeros(self.shape, dtype=self.values.dtype)
+        dense[self.i - r0, self.j - c0] = self.values
+        if self.symmetric:
+            dense[self.j - r0, self.i - c0] = self.values
+        return dense
+
+    def __array__(self, dtype=None, copy=None):
+        dense = self.toarray()
+        return dense if dtype is None else dense.astype(dtype)
+
+    def max(self, axis=None, out=None):
+        return self.values.max()
+
+    def argmax(self, axis=None, out=None):
+        n = int(np.argmax(self.values))
+        r, c = int(self.i[n]) - self.offset[0], int(self.j[n]) - self.offset[1]
+        if self.symmetric:
+            # match dense argmax: the mirrored cell comes first in row-major order
+            r, c = min(r, c), max(r, c)
+        return int(np.ravel_multi_index((r, c), self.shape))
+
+def _triple_sums(FA: np.ndarray, FB: np.ndarray, FC: np.ndarray, i, j, k, valid, S3=None, S2=None,
+                 workers: Optional[int]=None):
+    """
+    Sum A[i] B[j] conj(C[i+j]) and |A[i]||B[j]||C[i+j]| over segments.
+    FA/FB/FC are (nseg, nF) segment spectra; i/j/k broadcast to valid.shape.
+    Sums are added into S3/S2 when given, else into fresh arrays.
+
+    The plane is cut into fixed tiles along its leading axis and each tile is
+    reduced over the same segment blocks whatever the worker count, so a thread
+    pool (workers > 1) only changes who computes a tile, never the result bits.
+    """
+    nseg = FA.shape[0]
+    MA, MB, MC = np.abs(FA), np.abs(FB), np.abs(FC)
+    if S3 is None:
+        S3 = np.zeros(valid.shape, dtype=FA.dtype)
+    if S2 is None:
+        S2 = np.zeros(valid.shape, dtype=MA.dtype)
+    CC = np.conj(FC)
+    n0 = valid.shape[0]
+    rows = max(1, _TILE_ELEMS // max(1, valid.size // max(1, n0)))
+
+    def tile(t):
+        ti, tj, tk = (a[t] if a.shape[0] == n0 else a for a in (i, j, k))
+        blk = max(1, _BLOCK_ELEMS // max(1, valid[t].size))
+        for s in range(0, nseg, blk):
+            sl = slice(s, s + blk)
+            S3[t] += np.einsum("s...,s...,s...->...", FA[sl][:, ti], FB[sl][:, tj], CC[sl][:, tk])
+            S2[t] += np.einsum("s...,s...,s...->...", MA[sl][:, ti], MB[sl][:, tj], MC[sl][:, tk])
+
+    tiles = [slice(r, r + rows) for r in range(0, n0, rows)]
+    if workers is not None and workers > 1 and len(tiles) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(tile, tiles))
+    else:
+        for t in tiles:
+            tile(t)
+    if not valid.all():
+        S3[~valid] = 0.0
+        S2[~valid] = 0.0
+    return S3, S2
+
+def _band(f: np.ndarray, f_range: Optional[Tuple[float, float]]):
+    """Half-open bin range [lo, hi) covering f_range in Hz (None = all bins)."""
+    if f_range is None:
+        return None
+    lo, hi = f_range
+    idx = np.flatnonzero((f >= lo) & (f <= hi))
+    if idx.size == 0:
+        raise ValueError(f"Frequency range {f_range} contains no bins (df={f[1]-f[0]:.4g} Hz).")
+    return int(idx[0]), int(idx[-1]) + 1
+
+def _roi(f: np.ndarray, f1_range, f2_range):
+    """Row/column bin ranges and the frequency value(s) returned to the caller."""
+    rows, cols = _band(f, f1_range), _band(f, f2_range)
+    if rows is None and cols is None:
+        return rows, cols, f
+    f1 = f if rows is None else f[rows[0]:rows[1]]
+    f2 = f if cols is None else f[cols[0]:cols[1]]
+    return rows, cols, (f1, f2)
+
+def _bicoherence(S3: np.ndarray, S2: np.ndarray, nseg: int):
+    """Normalise the sums in place; b2 overwrites S2's buffer, in row blocks to bound temporaries."""
+    S3 /= nseg
+    S2 /= nseg + 1e-12
+    per = max(1, _BLOCK_ELEMS // max(1, S2[:1].size))
+    for r in range(0, len(S2), per):
+        s2 = S2[r:r + per]
+        s2[...] = (np.abs(S3[r:r + per])**2) / ((s2**2)+1e-20)
+    return S3, S2
+
+def _packed(S3, b2, i, j, rows, cols, nF, symmetric):
+    r0, r1 = rows if rows is not None else (0, nF)
+    c0, c1 = cols if cols is not None else (0, nF)
+    shape, offset = (r1 - r0, c1 - c0), (r0, c0)
+    return (PackedBispectrum(S3, i, j, shape, offset, symmetric),
+            PackedBispectrum(b2, i, j, shape, offset, symmetric))
+
+def _spectra(x: np.ndarray, seglen: int, step: Optional[int], dtype=np.float64):
+    X = _segment(x, seglen, step, dtype)
+    win = np.hanning(seglen).astype(dtype)[None, :]
+    return rfft(X*win, axis=1)
+
+class SegmentSpectra:
+    """
+    Hann-windowed rfft of every segment of one channel, computed once so the
+    uni-/cross-bispectrum and spectral-peak routines can share it.
+    F has shape (nseg, nF) (complex64 with precision="float32"); f is the rfft frequency axis.
+    """
+    def __init__(self, x: np.ndarray, fs: float, seglen: int, step: Optional[int]=None, detrend: bool=True,
+                 precision: str="float64"):
+        real, _ = _dtypes(precision)
+        x = np.asarray(x, dtype=real)
+        self.fs = fs
+        self.seglen = seglen
+        self.step = seglen//2 if step is None else step
+        self.precision = precision
+        self.F = _spectra(x - (x.mean() if detrend else 0.0), seglen, self.step, real)
+        self.f = rfftfreq(seglen, d=1.0/fs)
+
+    @property
+    def nseg(self):
+        return self.F.shape[0]
+
+    def magnitude(self):
+        """Segment-averaged magnitude spectrum."""
+        return np.abs(self.F).mean(axis=0)
+
+def _as_spectra(x, fs, seglen, step, detrend=True, precision="float64"):
+    """Pass SegmentSpectra through (checking any explicit settings) or transform raw samples."""
+    if not isinstance(x, SegmentSpectra):
+        if fs is None or seglen is None:
+            raise ValueError("fs and seglen are required for raw samples.")
+        return SegmentSpectra(x, fs, seglen, step, detrend=detrend, precision=precision)
+    for name, want in (("fs", fs), ("seglen", seglen), ("step", step)):
+        if want is not None and want != getattr(x, name):
+            raise ValueError(f"{name}={want} does not match SegmentSpectra {name}={getattr(x, name)}.")
+    return x
 
-def cross_bispectrum(x: np.ndarray, y: np.ndarray, z: np.ndarray, fs: float, seglen: int, step: Optional[int]=None):
-    from numpy.fft import rfft
-    Xs = _segment(x - np.mean(x), seglen, step)
-    Ys = _segment(y - np.mean(y), seglen, step)
-    Zs = _segment(z - np.mean(z), seglen, step)
-    win = np.hanning(seglen)[None, :]
-    FX = rfft(Xs*win, axis=1); FY = rfft(Ys*win, axis=1); FZ = rfft(Zs*win, axis=1)
-    nF = FX.shape[1]
-    S3 = np.zeros((nF, nF), dtype=complex)
-    S2 = np.zeros((nF, nF), dtype=float)
-    for a,b,c in zip(FX,FY,FZ):
-        for i in range(nF):
-            for j in range(nF):
-                k = i + j
-                if k < nF:
-                    S3[i,j] += a[i]*b[j]*np.conj(c[k])
-                    S2[i,j] += (np.abs(a[i])*np.abs(b[j])*np.abs(c[k]))
-    S3 /= FX.shape[0]
-    S2 /= FX.shape[0] + 1e-12
-    f = rfftfreq(seglen, d=1.0/(fs))
+def _cross_spectra(sigs, fs, seglen, step, precision="float64"):
+    specs = [_as_spectra(s, fs, seglen, step, precision=precision) for s in sigs]
+    if len({(s.fs, s.seglen, s.step, s.nseg) for s in specs}) != 1:
+        raise ValueError("Cross-bispectrum inputs must share fs, seglen, step and segment count.")
+    return specs
+
+class BispectrumAccumulator:
+    """
+    Streaming segment-averaged bispectrum (channels=1) or cross-bispectrum (channels=3).
+
+    update() takes the next chunk of samples per channel; the samples of an
+    unfinished segment are carried over, so feeding a recording in pieces gives
+    the same segments as feeding it whole. Running S3/S2 sums and the segment
+    count are kept, and merge() combines accumulators built from disjoint parts
+    of a recording (e.g. per worker or per file). Samples are used as given;
+    subtract the channel mean beforehand if detrending is wanted.
+    """
+    def __init__(self, fs: float, seglen: int, step: Optional[int]=None, channels: int=1,
+                 f1_range: Optional[Tuple[float, float]]=None, f2_range: Optional[Tuple[float, float]]=None,
+                 packed: bool=False, workers: Optional[int]=None, memmap: Optional[str]=None,
+                 precision: str="float64"):
+        if channels not in (1, 3):
+            raise ValueError("channels must be 1 (auto) or 3 (cross).")
+        self.fs = fs
+        self.seglen = seglen
+        self.step = seglen//2 if step is None else step
+        self.channels = channels
+        self.packed = packed
+        self.workers = workers
+        self.nF = seglen//2 + 1
+        self.rows, self.cols, self.f = _roi(rfftfreq(seglen, d=1.0/fs), f1_range, f2_range)
+        self.symmetric = channels == 1 and self.rows == self.cols
+        if packed:
+            self._index = _pair_index(self.nF, self.rows, self.cols, symmetric=self.symmetric)
+        else:
+            self._index = _triple_index(self.nF, self.rows, self.cols)
+        shape = self._index[3].shape
+        self.precision = precision
+        self._real, self._complex = _dtypes(precision)
+        if memmap is not None:
+            # file-backed sums; result(inplace=True) leaves S3 and b2 in these files
+            self.S3 = open_memmap(f"{memmap}_S3.npy", mode="w+", dtype=self._complex, shape=shape)
+            self.S2 = open_memmap(f"{memmap}_b2.npy", mode="w+", dtype=self._real, shape=shape)
+        else:
+            self.S3 = np.zeros(shape, dtype=self._complex)
+            self.S2 = np.zeros(shape, dtype=self._real)
+        self.memmap = memmap
+        self.finalized = False
+        self.nseg = 0
+        self._tail = [np.empty(0, dtype=self._real) for _ in range(channels)]
+        self._skip = 0                 # samples still to drop before the next segment (step > seglen)
+
+    def update(self, *chunks: np.ndarray):
+        """Append one chunk of samples per channel and accumulate all completed segments."""
+        if len(chunks) != self.channels:
+            raise ValueError(f"Expected {self.channels} channel chunk(s), got {len(chunks)}.")
+        bufs = []
+        for tail, chunk in zip(self._tail, chunks):
+            chunk = np.asarray(chunk, dtype=self._real)
+            bufs.append(np.concatenate([tail, chunk]) if tail.size else chunk)
+        if any(len(b) != len(bufs[0]) for b in bufs):
+            raise ValueError("Channel chunks must have equal length.")
+        drop = min(self._skip, len(bufs[0]))
+        bufs = [b[drop:] for b in bufs]
+        self._skip -= drop
+        n = len(bufs[0])
+        nseg = 0 if n < self.seglen else 1 + (n - self.seglen)//self.step
+        if nseg:
+            used = (nseg - 1)*self.step + self.seglen
+            self.add_spectra(*(_spectra(b[:used], self.seglen, self.step, self._real) for b in bufs))
+            self._skip = max(0, nseg*self.step - n)
+        self._tail = [b[nseg*self.step:].copy() for b in bufs]
+        return self
+
+    def add_spectra(self, *F):
+        """Accumulate precomputed windowed segment spectra ((nseg, nF) arrays or SegmentSpectra), one per channel."""
+        if self.finalized:
+            raise ValueError("Accumulator was finalised by result(inplace=True).")
+        F = [np.asarray(a.F if isinstance(a, SegmentSpectra) else a, dtype=self._complex) for a in F]
+        FA, FB, FC = F if self.channels == 3 else (F[0], F[0], F[0])
+        _triple_sums(FA, FB, FC, *self._index, S3=self.S3, S2=self.S2, workers=self.workers)
+        self.nseg += FA.shape[0]
+        return self
+
+    def merge(self, other: "BispectrumAccumulator"):
+        """Add the sums of another accumulator with identical settings (its carried samples are dropped)."""
+        same = (self.fs, self.seglen, self.step, self.channels, self.packed, self.rows, self.cols, self.precision)
+        if same != (other.fs, other.seglen, other.step, other.channels, other.packed, other.rows, other.cols,
+                    other.precision):
+            raise ValueError("Cannot merge accumulators with different settings.")
+        self.S3 += other.S3
+        self.S2 += other.S2
+        self.nseg += other.nseg
+        return self
+
+    def result(self, inplace: bool=False):
+        """
+        Return f, S3, b2 for the segments accumulated so far. inplace=True normalises
+        the running sums in their own buffers (no copy of the plane, and for a memmap
+        accumulator the outputs stay in the .npy files); the accumulator is spent after.
+        """
+        if self.nseg == 0:
+            raise ValueError("No complete segments accumulated (need at least seglen samples).")
+        if self.finalized:
+            raise ValueError("Accumulator was finalised by result(inplace=True).")
+        if inplace:
+            self.finalized = True
+            S3, b2 = _bicoherence(self.S3, self.S2, self.nseg)
+            if self.memmap is not None:
+                S3.flush()
+                b2.flush()
+        else:
+            S3, b2 = _bicoherence(self.S3.copy(), self.S2.copy(), self.nseg)
+        if self.packed:
+            i, j = self._index[0], self._index[1]
+            return (self.f, *_packed(S3, b2, i, j, self.rows, self.cols, self.nF, self.symmetric))
+        return self.f, S3, b2
+
+def _smoothing_kernel(width: int, kernel: str):
+    """1-D kernel taps; the 2-D kernel is their outer product."""
+    if kernel == "box":
+        return np.ones(width)
+    if kernel == "hann":
+        return np.hanning(width + 2)[1:-1]
+    raise ValueError(f"Unknown smoothing kernel: {kernel!r} (use 'box' or 'hann').")
+
+def _kernel_taps(centers: np.ndarray, w: np.ndarray, n: int):
+    """Fine indices (clipped) and weights (zero off the axis) of the kernel around each center."""
+    idx = centers[:, None] + np.arange(len(w)) - len(w)//2
+    inside = (idx >= 0) & (idx < n)
+    return np.clip(idx, 0, n - 1), np.where(inside, w, 0.0)
+
+def _direct_bispectrum(sigs, fs: float, seglen: int, f1_range, f2_range, smooth: Optional[int], kernel: str,
+                       precision: str="float64"):
+    """
+    Direct (frequency-smoothed) estimator for 1 (auto) or 3 (cross) detrended signals.
+    The record is cut to R*seglen samples so fine bin c*R sits exactly on seglen bin c;
+    the kernel is smooth fine bins wide (odd; default about R, i.e. the seglen resolution).
+    The kernel is separable, so each output is two weighted sums over the fine bins it
+    covers; only those bins are built and nothing is computed off the coarse grid.
+    """
+    if seglen is None or fs is None:
+        raise ValueError("fs and seglen are required for method='direct'.")
+    R = len(sigs[0]) // seglen
+    if R < 1:
+        raise ValueError(f"Record shorter than seglen={seglen}.")
+    n = R*seglen
+    real, cplx = _dtypes(precision)
+    win = np.hanning(n).astype(real)
+    F = [rfft(np.asarray(s[:n], dtype=real)*win) for s in sigs]
+    FA, FB, FC = F if len(F) == 3 else (F[0], F[0], F[0])
+    nFf = len(FA)
+    nF = seglen//2 + 1
+    rows, cols, f = _roi(rfftfreq(seglen, d=1.0/fs), f1_range, f2_range)
+    r0, r1 = rows if rows is not None else (0, nF)
+    c0, c1 = cols if cols is not None else (0, nF)
+    width = R + 1 - R % 2 if smooth is None else int(smooth) | 1
+    w = _smoothing_kernel(width, kernel)
+    w = (w / w.sum()).astype(real)
+    j, wj = _kernel_taps(np.arange(c0, c1)*R, w, nFf)
+    jf = j.ravel()
+    S3 = np.empty((r1 - r0, c1 - c0), dtype=cplx)
+    S2 = np.empty((r1 - r0, c1 - c0), dtype=real)
+    # output rows in blocks; each block builds only the fine (row, col) taps of its outputs
+    per = max(1, _BLOCK_ELEMS // (width*jf.size))
+    for p0 in range(r0, r1, per):
+        p1 = min(r1, p0 + per)
+        i, wi = _kernel_taps(np.arange(p0, p1)*R, w, nFf)
+        k = i.reshape(-1, 1) + jf[None, :]
+        valid = k < nFf
+        k = np.where(valid, k, 0)
+        T3 = np.where(valid, FA[i.reshape(-1, 1)]*FB[jf]*np.conj(FC[k]), 0.0)
+        T2 = np.where(valid, np.abs(FA[i.reshape(-1, 1)])*np.abs(FB[jf])*np.abs(FC[k]), 0.0)
+        shape = (p1 - p0, width, c1 - c0, width)
+        S3[p0 - r0:p1 - r0] = np.einsum("awbv,aw,bv->ab", T3.reshape(shape), wi, wj, optimize=True)
+        S2[p0 - r0:p1 - r0] = np.einsum("awbv,aw,bv->ab", T2.reshape(shape), wi, wj, optimize=True)
+    coarse = (np.arange(r0, r1)[:, None] + np.arange(c0, c1)[None, :]) < nF
+    S3 = np.where(coarse, S3, 0.0)
+    S2 = np.where(coarse, S2, 0.0)
     b2 = (np.abs(S3)**2) / ((S2**2)+1e-20)
     return f, S3, b2
+
+def bispectrum(x, fs: float=None, seglen: int=None, step: Optional[int]=None, detrend: bool=True,
+               f1_range: Optional[Tuple[float, float]]=None, f2_range: Optional[Tuple[float, float]]=None,
+               packed: bool=False, workers: Optional[int]=None,
+               method: str="segment", smooth: Optional[int]=None, kernel: str="box",
+               memmap: Optional[str]=None, precision: str="float64"):
+    """
+    x is a 1-D signal or a SegmentSpectra (then fs/seglen/step are taken from it).
+    f1_range/f2_range=(lo, hi) Hz restrict the plane to that rectangle; f is then the
+    (f1_axis, f2_axis) pair. packed=True evaluates only the principal domain (i + j < nF,
+    i >= j) and returns S3/b2 as PackedBispectrum. workers=N spreads the bin tiles over
+    N threads with bit-identical results.
+    method="direct" uses the frequency-smoothing estimator (raw samples, dense output;
+    smooth = kernel width in fine bins, kernel = "box" or "hann"). Its cost grows as
+    smooth**2 per bin and, at the default width, is well above method="segment";
+    a narrower kernel is cheaper but has higher variance.
+    memmap="path/prefix" keeps S3 and b2 in prefix_S3.npy / prefix_b2.npy memmaps.
+    precision="float32" keeps samples, spectra and sums in float32/complex64.
+    """
+    if method == "direct":
+        if isinstance(x, SegmentSpectra) or packed or memmap is not None:
+            raise ValueError("method='direct' needs raw samples and dense in-memory output.")
+        x = np.asarray(x, dtype=_dtypes(precision)[0])
+        return _direct_bispectrum([x - (x.mean() if detrend else 0.0)], fs, seglen,
+                                  f1_range, f2_range, smooth, kernel, precision)
+    if method != "segment":
+        raise ValueError(f"Unknown method: {method!r} (use 'segment' or 'direct').")
+    spec = _as_spectra(x, fs, seglen, step, detrend=detrend, precision=precision)
+    acc = BispectrumAccumulator(spec.fs, spec.seglen, spec.step, channels=1,
+                                f1_range=f1_range, f2_range=f2_range, packed=packed, workers=workers,
+                                memmap=memmap, precision=precision)
+    acc.add_spectra(spec)
+    return acc.result(inplace=True)
+
+def cross_bispectrum(x, y, z, fs: float=None, seglen: int=None, step: Optional[int]=None,
+                     f1_range: Optional[Tuple[float, float]]=None, f2_range: Optional[Tuple[float, float]]=None,
+                     packed: bool=False, workers: Optional[int]=None,
+                     method: str="segment", smooth: Optional[int]=None, kernel: str="box",
+                     memmap: Optional[str]=None, precision: str="float64"):
+    """
+    x, y, z are 1-D signals or SegmentSpectra sharing fs/seglen/step.
+    ROI, packed, workers, method/smooth/kernel, memmap and precision as for bispectrum().
+    """
+    if method == "direct":
+        if any(isinstance(s, SegmentSpectra) for s in (x, y, z)) or packed or memmap is not None:
+            raise ValueError("method='direct' needs raw samples and dense in-memory output.")
+        real = _dtypes(precision)[0]
+        sigs = [np.asarray(s, dtype=real) - np.mean(np.asarray(s, dtype=real)) for s in (x, y, z)]
+        return _direct_bispectrum(sigs, fs, seglen, f1_range, f2_range, smooth, kernel, precision)
+    if method != "segment":
+        raise ValueError(f"Unknown method: {method!r} (use 'segment' or 'direct').")
+    specs = _cross_spectra((x, y, z), fs, seglen, step, precision)
+    acc = BispectrumAccumulator(specs[0].fs, specs[0].seglen, specs[0].step, channels=3,
+                                f1_range=f1_range, f2_range=f2_range, packed=packed, workers=workers,
+                                memmap=memmap, precision=precision)
+    acc.add_spectra(*specs)
+    return acc.result(inplace=True)
+
+def _sum_line_index(f: np.ndarray, f3: float, halfwidth: float):
+    """Sum bins ks within +/- halfwidth of f3 and the (lines, f1) index grid along them."""
+    df = f[1] - f[0]
+    k0 = int(round(f3/df))
+    w = int(np.floor(halfwidth/df + 1e-9))
+    ks = np.arange(max(0, k0 - w), min(len(f) - 1, k0 + w) + 1)
+    if ks.size == 0:
+        raise ValueError(f"f3={f3} Hz is outside the rfft axis (0..{f[-1]:.4g} Hz).")
+    i = np.arange(ks[-1] + 1)[None, :]
+    j = ks[:, None] - i
+    valid = j >= 0
+    j = np.where(valid, j, 0)
+    k = np.where(valid, ks[:, None], 0)
+    return ks, i, j, k, valid
+
+def sum_frequency_bicoherence(x, y, z, f3: float, fs: float=None, seglen: int=None, step: Optional[int]=None,
+                              halfwidth: float=0.0, precision: str="float64", lines: bool=False):
+    """
+    Cross-bicoherence along the sum line f1 + f2 = f3 only (pass x for y and z for an auto check).
+    Every sum bin within +/- halfwidth Hz of f3 is evaluated; the profile keeps, for each f1,
+    the largest b2 over those lines. Cost is O(nseg * nF * lines) instead of O(nseg * nF^2).
+    Returns f1 (Hz), f3_line (Hz, sum frequency attaining each value) and b2, all 1-D.
+    lines=True also returns every evaluated bin: the line frequencies f3 (Hz) and the
+    (lines, f1) b2 grid (0 where f2 < 0), e.g. to count the bins behind the profile max.
+    precision applies to raw samples; SegmentSpectra keep their own.
+    """
+    FX, FY, FZ = _cross_spectra((x, y, z), fs, seglen, step, precision)
+    f = FX.f
+    ks, i, j, k, valid = _sum_line_index(f, f3, halfwidth)
+    S3, S2 = _triple_sums(FX.F, FY.F, FZ.F, i, j, k, valid)
+    _, b2 = _bicoherence(S3, S2, FX.nseg)
+    line = np.argmax(b2, axis=0)
+    out = (f[:ks[-1] + 1], f[ks[line]], b2[line, np.arange(b2.shape[1])])
+    return out + (f[ks], b2) if lines else out
+
+def _peak_bins(mag: np.ndarray, top_k: int):
+    """Bins of the top_k local maxima of a magnitude spectrum (DC excluded)."""
+    m = np.asarray(mag, dtype=float).copy()
+    m[0] = 0.0
+    loc = np.flatnonzero((m[1:-1] >= m[:-2]) & (m[1:-1] >= m[2:])) + 1
+    return loc[np.argsort(m[loc])[::-1][:top_k]]
+
+def peak_guided_bicoherence(x, y, z, fs: float=None, seglen: int=None, step: Optional[int]=None,
+                            top_k: int=3, radius: int=2, workers: Optional[int]=None,
+                            precision: str="float64"):
+    """
+    Cross-bicoherence evaluated only around candidate (f1, f2) pairs.
+    Candidates pair each of the top_k spectral peaks of x (f1) with the top_k peaks of y
+    and with f3 - f1 for the top_k peaks f3 of z; every pair is widened to a
+    (2*radius+1)^2 bin neighbourhood. Returns f, S3, b2 with S3/b2 as PackedBispectrum
+    over the candidate pairs, so find_bicoherence_peak and max() work unchanged.
+    precision as for sum_frequency_bicoherence().
+    """
+    specs = _cross_spectra((x, y, z), fs, seglen, step, precision)
+    nF = len(specs[0].f)
+    pi, pj, pk = (_peak_bins(s.magnitude(), top_k) for s in specs)
+    ci = np.repeat(pi, len(pj) + len(pk))
+    cj = np.concatenate([np.concatenate([pj, pk - a]) for a in pi])
+    off = np.arange(-radius, radius + 1)
+    ii = (ci[:, None, None] + off[None, :, None]).repeat(len(off), axis=2).ravel()
+    jj = (cj[:, None, None] + off[None, None, :]).repeat(len(off), axis=1).ravel()
+    keep = (ii >= 0) & (jj >= 0) & (ii + jj < nF)
+    pairs = np.unique(np.stack([ii[keep], jj[keep]], axis=1), axis=0)
+    i, j = pairs[:, 0], pairs[:, 1]
+    valid = np.ones(i.shape, dtype=bool)
+    S3, S2 = _triple_sums(specs[0].F, specs[1].F, specs[2].F, i, j, i + j, valid, workers=workers)
+    S3, b2 = _bicoherence(S3, S2, specs[0].nseg)
+    return (specs[0].f, *_packed(S3, b2, i, j, None, None, nF, False))
+
+def _batch_spectra(X: np.ndarray, seglen: int, step: int, dtype):
+    """(B, nseg, nF) detrended, Hann-windowed segment spectra of the rows of X in one rfft."""
+    X = np.asarray(X, dtype=dtype)
+    X = X - X.mean(axis=1, keepdims=True)
+    segs = sliding_window_view(X, seglen, axis=1)[:, ::step]
+    return rfft(segs*np.hanning(seglen).astype(dtype), axis=2)
+
+def _batch_max(FA, FB, FC, i, j, k, valid, workers: Optional[int]=None):
+    """
+    Per-row maximum of b2 over the valid bins for (B, nseg, nF) spectra stacks. Tiles of
+    the index set are reduced for all B rows at once and only their maxima are kept,
+    so no (B, plane) array is ever held. Spectra are laid out (nF, B, nseg) so each
+    gathered bin is one contiguous B x nseg block.
+    """
+    nB, nseg = FA.shape[:2]
+    FA, FB, CC = (np.ascontiguousarray(F.transpose(2, 0, 1)) for F in (FA, FB, np.conj(FC)))
+    MA, MB, MC = np.abs(FA), np.abs(FB), np.abs(CC)
+    n0 = valid.shape[0]
+    per_row = nB*nseg*(valid.size // max(1, n0))
+    rows = max(1, min(_TILE_ELEMS*nB, _BLOCK_ELEMS) // max(1, per_row))
+    blk = nseg if per_row <= _BLOCK_ELEMS else max(1, _BLOCK_ELEMS*nseg // per_row)
+
+    def tile(t):
+        ti, tj, tk = (a[t] if a.shape[0] == n0 else a for a in (i, j, k))
+        vt = valid[t]
+        S3 = np.zeros(vt.shape + (nB,), dtype=FA.dtype)
+        S2 = np.zeros(vt.shape + (nB,), dtype=MA.dtype)
+        for s in range(0, nseg, blk):
+            sl = slice(s, s + blk)
+            S3 += np.einsum("...s,...s,...s->...", FA[:, :, sl][ti], FB[:, :, sl][tj], CC[:, :, sl][tk])
+            S2 += np.einsum("...s,...s,...s->...", MA[:, :, sl][ti], MB[:, :, sl][tj], MC[:, :, sl][tk])
+        b2 = _bicoherence(S3, S2, nseg)[1]
+        return np.where(vt[..., None], b2, 0.0).reshape(-1, nB).max(axis=0)
+
+    tiles = [slice(r, r + rows) for r in range(0, n0, rows)]
+    if workers is not None and workers > 1 and len(tiles) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            peaks = list(pool.map(tile, tiles))
+    else:
+        peaks = [tile(t) for t in tiles]
+    return np.max(peaks, axis=0)
+
+def batch_max_bicoherence(x, y, z, fs: float, seglen: int, step: Optional[int]=None,
+                          f1_range: Optional[Tuple[float, float]]=None, f2_range: Optional[Tuple[float, float]]=None,
+                          f3: Optional[float]=None, halfwidth: float=0.0, precision: str="float64",
+                          workers: Optional[int]=None):
+    """
+    Peak cross-bicoherence of each of B signal triples given as (B, N) arrays, e.g. from
+    surrogates.phase_randomize_batch: the batched counterpart of calling cross_bispectrum()
+    (or, with f3, sum_frequency_bicoherence()) B times and taking .max(). All B x 3
+    records are segmented and transformed in one rfft and share one pass over the index
+    tiles. Returns a (B,) array. Memory is ~3 x B x N spectra; feed chunks for large B.
+    """
+    real, _ = _dtypes(precision)
+    step = seglen//2 if step is None else step
+    FA, FB, FC = (_batch_spectra(np.atleast_2d(s), seglen, step, real) for s in (x, y, z))
+    if FA.shape != FB.shape or FA.shape != FC.shape:
+        raise ValueError("x, y, z must have the same (B, N) shape.")
+    f = rfftfreq(seglen, d=1.0/fs)
+    if f3 is not None:
+        index = _sum_line_index(f, f3, halfwidth)[1:]
+    else:
+        rows, cols, _ = _roi(f, f1_range, f2_range)
+        index = _triple_index(len(f), rows, cols)
+    return _batch_max(FA, FB, FC, *index, workers=workers)
+
+class SlidingBicoherence:
+    """
+    Windowed bicoherence at fixed bins i/j (broadcast like the engine index grids),
+    kept as a ring buffer of the last win_segs per-segment triple-product terms.
+    push() adds the newest segment and subtracts the one leaving the window; the
+    running sums are re-added from the buffer once per revolution to bound drift.
+    """
+    def __init__(self, i, j, nF: int, win_segs: int):
+        k = i + j
+        valid = k < nF
+        self.i, self.j, self.k, self.valid = i, j, np.where(valid, k, 0), valid
+        self.win_segs = win_segs
+        self._c3 = np.zeros((win_segs,) + valid.shape, dtype=complex)
+        self._c2 = np.zeros((win_segs,) + valid.shape, dtype=float)
+        self._S3 = np.zeros(valid.shape, dtype=complex)
+        self._S2 = np.zeros(valid.shape, dtype=float)
+        self.count = 0
+
+    @property
+    def ready(self):
+        return self.count >= self.win_segs
+
+    def push(self, a: np.ndarray, b: np.ndarray, c: np.ndarray):
+        """Add one segment's spectra (rows of FA/FB/FC) to the window."""
+        ai, bj, ck = a[self.i], b[self.j], c[self.k]
+        slot = self.count % self.win_segs
+        if self.ready:
+            self._S3 -= self._c3[slot]
+            self._S2 -= self._c2[slot]
+        self._c3[slot] = np.where(self.valid, ai*bj*np.conj(ck), 0.0)
+        self._c2[slot] = np.where(self.valid, np.abs(ai)*np.abs(bj)*np.abs(ck), 0.0)
+        self._S3 += self._c3[slot]
+        self._S2 += self._c2[slot]
+        self.count += 1
+        if self.count % self.win_segs == 0:
+            self._S3 = self._c3.sum(axis=0)
+            self._S2 = self._c2.sum(axis=0)
+        return self
+
+    def b2(self):
+        """Bicoherence of the current window."""
+        return _bicoherence(self._S3.copy(), self._S2.copy(), min(self.count, self.win_segs))[1]
+
+def sliding_bicoherence(x, y, z, fs: float=None, seglen: int=None, step: Optional[int]=None,
+                        win_segs: int=16, hop_segs: int=1, pairs=None,
+                        f1_range: Optional[Tuple[float, float]]=None, f2_range: Optional[Tuple[float, float]]=None):
+    """
+    Time-resolved cross-bicoherence over windows of win_segs segments, advanced by hop_segs.
+    Bins are either pairs=[(f1, f2), ...] in Hz (snapped to the nearest bins) or the
+    f1_range/f2_range rectangle (full plane if neither; memory grows as win_segs * nF^2).
+    Returns t (window centres, s), f and b2 of shape (n_windows, ...): f is the (P, 2)
+    array of snapped pair frequencies for pairs, else as returned by cross_bispectrum.
+    """
+    FX, FY, FZ = _cross_spectra((x, y, z), fs, seglen, step)
+    fax = FX.f
+    nF = len(fax)
+    if pairs is not None:
+        bins = np.rint(np.asarray(pairs, dtype=float) / (fax[1] - fax[0])).astype(int)
+        if np.any(bins < 0) or np.any(bins >= nF):
+            raise ValueError("pairs must lie within the rfft axis.")
+        i, j = bins[:, 0], bins[:, 1]
+        f = fax[bins]
+    else:
+        rows, cols, f = _roi(fax, f1_range, f2_range)
+        i, j = _triple_index(nF, rows, cols)[:2]
+    win = SlidingBicoherence(i, j, nF, win_segs)
+    t, out = [], []
+    for s in range(FX.nseg):
+        win.push(FX.F[s], FY.F[s], FZ.F[s])
+        first = s - win_segs + 1
+        if win.ready and first % hop_segs == 0:
+            t.append((first*FX.step + s*FX.step + FX.seglen) / 2.0 / FX.fs)
+            out.append(win.b2())
+    if not out:
+        raise ValueError(f"Need at least win_segs={win_segs} segments, got {FX.nseg}.")
+    return np.array(t), f, np.stack(out)
@@ -53,12 +53,13 @@ def load_event_times(path):
     else:
         raise ValueError(f"Unsupported extension: {ext}")
 
-def bin_events(ch_times, fs=1e6, T=None, t0=None):
+def bin_events(ch_times, fs=1e6, T=None, t0=None, dtype=float):
     """
     Bin event times into counts per bin.
     fs: sampling rate for bins (Hz); default 1 MHz bins
     T: total duration (seconds); if None, deduced from max event
     t0: start time; default min event
+    dtype: count dtype (np.float32 halves memory for single-precision analysis)
     Returns t (N,), X (N,C)
     """
     if not ch_times:
@@ -74,7 +75,7 @@ def bin_events(ch_times, fs=1e6, T=None, t0=None):
     for arr in ch_times:
         idx = np.clip(((arr - t0) * fs).astype(int), 0, N-1)
         counts = np.bincount(idx, minlength=N)
-        X.append(counts.astype(float))
+        X.append(counts.astype(dtype))
     X = np.stack(X, axis=1)  # (N,C)
     t = 0.5*(edges[:-1] + edges[1:])
     return t, X
@@ -2,10 +2,15 @@
 analysis/jpc_batch.py
 Batch analysis for JPC CSV files:
 - Load time series
-- Compute cross-bicoherence among (mode1, mode2, mode3)
-- Extract peak and estimate significance via phase-shuffled surrogates
+- Compute cross-bicoherence among (mode1, mode2, mode3), either over the full
+  bifrequency plane or (mode="slice") only along the sum line f1+f2=f3_est
+- Extract peak and estimate significance via phase-shuffled surrogates (all B, or
+  significance="sequential" stopping early once the call is clear), from a
+  Gumbel fit to a few surrogate maxima (significance="evd"), or
+  (significance="analytic") from the chi-square null without surrogates
 - Save summary CSV and annotated plots
 """
+import argparse
 import glob
 import os
 from pathlib import Path
@@ -14,10 +19,11 @@ import numpy as np
 import pandas as pd
 
 from analysis.load_timeseries import load_timeseries
-from analysis.bispectrum import cross_bispectrum
+from analysis.bispectrum import cross_bispectrum, sum_frequency_bicoherence, batch_max_bicoherence, SegmentSpectra
+from analysis.bispec_plan import preflight_batch, describe, add_budget_args, add_precision_arg
 from analysis.bispec_peaks import dominant_freq, find_bicoherence_peak
-from analysis.surrogates import phase_randomize, peak_zscore
-from analysis.plot_bispec_with_peak import plot as plot_annot
+from analysis.surrogates import run_surrogates, peak_zscore, evd_peak_test, sequential_peak_test, analytic_peak_test, analytic_bins
+from analysis.plot_bispec_with_peak import plot as plot_annot, plot_slice
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
 DATA_DIR = PROJECT_ROOT / "data"
@@ -29,10 +35,32 @@ DEFAULT_SUMMARY = OUT_DIR / "jpc_batch_summary.csv"
 
 
 def analyze_file(path, outdir=DEFAULT_OUTDIR, seglen=4096, step=None,
-                 ch_names=("mode1_I", "mode2_I", "mode3_I"), B=50, seed=7):
+                 ch_names=("mode1_I", "mode2_I", "mode3_I"), B=50, seed=7,
+                 f1_range=None, f2_range=None, mode="plane", slice_halfwidth=None,
+                 significance="surrogate", precision="float64", surrogate_chunk=16,
+                 alpha=0.05, seq_batch=5, seq_min=10, surrogate_workers=None,
+                 surrogate_method="phase", evd_B=16, mem_budget=None, on_over="downgrade", memmap=False):
+    """
+    Surrogates are generated and evaluated surrogate_chunk at a time (batch_max_bicoherence),
+    spread over surrogate_workers processes; results do not depend on the worker count.
+    surrogate_method="iaaft" uses IAAFT instead of phase-randomised surrogates.
+    precision="float32" loads samples and runs the bicoherence (data and surrogates) in single precision.
+    mode="slice" evaluates b2 only along f1+f2=f3_est (+/- slice_halfwidth Hz, default two
+    bins) for the data and every surrogate; it falls back to the full plane if no f3_est.
+    significance="sequential" draws seq_batch surrogates at a time and stops once the p-value
+    interval is clear of alpha (at least seq_min, at most B); n_surrogates records the count.
+    significance="evd" fits a Gumbel law to min(B, evd_B) surrogate maxima (evd_peak_test)
+    and adds the fit diagnostics as evd_* columns.
+    significance="analytic" replaces the B surrogates by the chi-square max-statistic null
+    over the interior bins (analytic_bins; DC/Nyquist-edge bins are not tested).
+    The plane (or slice) plus surrogate_chunk triples per worker are checked against
+    mem_budget bytes (bispec_plan.preflight_batch) before anything large is allocated;
+    over budget the chunk shrinks, then the plane goes packed/memmap/narrower ROI, or
+    on_over="refuse" raises MemoryError. Packed or memmapped planes are not plotted.
+    """
     outdir = Path(outdir)
     outdir.mkdir(parents=True, exist_ok=True)
-    t, X, cols = load_timeseries(path)
+    t, X, cols = load_timeseries(path, dtype=precision)
     dt = np.median(np.diff(t))
     fs = 1.0 / dt
 
@@ -44,49 +72,104 @@ def analyze_file(path, outdir=DEFAULT_OUTDIR, seglen=4096, step=None,
             idx.append(cols.index(name))
     x, y, z = X[:, idx[0]], X[:, idx[1]], X[:, idx[2]]
 
-    f, Sxyz, b2 = cross_bispectrum(x, y, z, fs, seglen=seglen, step=step)
-    peak = find_bicoherence_peak(b2, f)
+    roi = dict(f1_range=f1_range, f2_range=f2_range)
+    specs = [SegmentSpectra(s, fs, seglen, step, precision=precision) for s in (x, y, z)]
 
-    fz, _ = dominant_freq(z, fs, nmax=1)
+    fz, _ = dominant_freq(specs[2], nmax=1)
     f3_est = float(fz[0]) if len(fz) > 0 else None
-
-    null_peaks = []
-    rng = np.random.default_rng(seed)
-    for _ in range(B):
-        xs = phase_randomize(x, seed=rng.integers(0, 1_000_000_000))
-        ys = phase_randomize(y, seed=rng.integers(0, 1_000_000_000))
-        zs = phase_randomize(z, seed=rng.integers(0, 1_000_000_000))
-        _, _, b2s = cross_bispectrum(xs, ys, zs, fs, seglen=seglen, step=step)
-        null_peaks.append(b2s.max())
-    zscore, pval, mu, sd = peak_zscore(peak["b2_peak"], null_peaks)
-
-    outpng = outdir / f"{Path(path).stem}_bicoherence_cross_annot.png"
-    plot_annot(f, b2, peak, f3_est=f3_est, outpng=str(outpng))
+    mode = "slice" if mode == "slice" and f3_est is not None else "plane"
+    halfwidth = 2.0 * fs / seglen if slice_halfwidth is None else slice_halfwidth
+
+    surrogates = significance in ("surrogate", "sequential", "evd")
+    chunk = seq_batch if significance == "sequential" else surrogate_chunk
+    lines = 2*int(np.floor(halfwidth*seglen/fs + 1e-9)) + 1 if mode == "slice" else None
+    plan, chunk = preflight_batch(len(x), seglen, chunk if surrogates else 0, processes=surrogate_workers,
+                                  budget=mem_budget, on_over=on_over, allow_roi=lines is None, step=step,
+                                  fs=fs, lines=lines, memmap=memmap, precision=precision, **roi)
+    print("Plan:", describe(plan))
+    roi = dict(f1_range=plan["f1_range"], f2_range=plan["f2_range"])
+    dense = not (plan["packed"] or plan["memmap"])
+
+    if mode == "slice":
+        f1s, f3s, prof, f3_lines, b2_lines = sum_frequency_bicoherence(*specs, f3_est, halfwidth=halfwidth,
+                                                                       lines=True)
+        n = int(np.argmax(prof))
+        peak = {"f1": float(f1s[n]), "f2": float(f3s[n] - f1s[n]), "b2_peak": float(prof[n]), "i": n}
+        # the profile is a max over all lines: test against every evaluated (line, f1) bin
+        tested = analytic_bins(b2_lines.ravel(), (np.tile(f1s, len(f3_lines)), np.repeat(f3_lines, len(f1s))), fs)
+    else:
+        f, Sxyz, b2 = cross_bispectrum(*specs, packed=plan["packed"], **roi,
+                                       memmap=str(outdir / f"{Path(path).stem}_bispec") if plan["memmap"] else None)
+        peak = find_bicoherence_peak(b2, f)
+        tested = analytic_bins(b2, f, fs)
+
+    if significance == "analytic":
+        zscore, pval, mu, sd = analytic_peak_test(tested.max(initial=0.0), specs[0].nseg, tested.size)
+        n_used = 0
+    elif surrogates:
+        # B surrogates per channel in chunks, each chunk one batched bicoherence job
+        B = min(B, evd_B) if significance == "evd" else B
+        where = dict(f3=f3_est, halfwidth=halfwidth) if mode == "slice" else roi
+        nulls = run_surrogates(batch_max_bicoherence, (x, y, z), B, seed=seed, chunk=chunk,
+                               workers=surrogate_workers, method=surrogate_method, fs=fs,
+                               seglen=seglen, step=step, precision=precision, **where)
+        if significance == "sequential":
+            zscore, pval, mu, sd, n_used = sequential_peak_test(peak["b2_peak"], nulls, alpha=alpha, min_B=seq_min)
+        elif significance == "evd":
+            null_peaks = np.concatenate(list(nulls))
+            zscore, pval, mu, sd, fit = evd_peak_test(peak["b2_peak"], null_peaks)
+            n_used = len(null_peaks)
+        else:
+            null_peaks = np.concatenate(list(nulls))
+            zscore, pval, mu, sd = peak_zscore(peak["b2_peak"], null_peaks)
+            n_used = len(null_peaks)
+    else:
+        raise ValueError(f"Unknown significance: {significance!r} (use 'surrogate', 'sequential', 'evd' or 'analytic').")
+
+    if mode == "slice":
+        outpng = outdir / f"{Path(path).stem}_bicoherence_slice.png"
+        plot_slice(f1s, prof, peak, f3_est, outpng=str(outpng))
+    elif dense:
+        outpng = outdir / f"{Path(path).stem}_bicoherence_cross_annot.png"
+        plot_annot(f, b2, peak, f3_est=f3_est, outpng=str(outpng))
+    else:
+        outpng = None
 
     row = {
         "file": str(path),
         "fs": fs,
         "seglen": seglen,
+        "mode": mode,
         "f1_peak": peak["f1"],
         "f2_peak": peak["f2"],
         "b2_peak": peak["b2_peak"],
         "f3_est": f3_est,
         "peak_z": zscore,
         "peak_p": pval,
+        "sig_method": significance,
+        "n_surrogates": n_used,
         "null_mean": mu,
         "null_sd": sd,
     }
-    return row, str(outpng)
+    if significance == "evd":
+        row.update({f"evd_{k}": fit[k] for k in ("loc", "scale", "ks_p", "ppcc", "extrapolation")})
+    return row, outpng and str(outpng)
 
 
 def main(glob_pattern=DEFAULT_GLOB_PATTERN, out_csv=DEFAULT_SUMMARY,
-         outdir=DEFAULT_OUTDIR, seglen=4096, step=None, B=50):
+         outdir=DEFAULT_OUTDIR, seglen=4096, step=None, B=50, f1_range=None, f2_range=None,
+         mode="plane", significance="surrogate", precision="float64", surrogate_workers=None,
+         surrogate_method="phase", mem_budget=None, on_over="downgrade", memmap=False):
     pattern = str(glob_pattern)
     files = sorted(glob.glob(pattern))
     results = []
     for fpath in files:
         try:
-            row, outpng = analyze_file(fpath, outdir=outdir, seglen=seglen, step=step, B=B)
+            row, outpng = analyze_file(fpath, outdir=outdir, seglen=seglen, step=step, B=B,
+                                       f1_range=f1_range, f2_range=f2_range, mode=mode,
+                                       significance=significance, precision=precision,
+                                       surrogate_workers=surrogate_workers, surrogate_method=surrogate_method,
+                                       mem_budget=mem_budget, on_over=on_over, memmap=memmap)
             results.append(row)
             print("Analyzed:", fpath, "peak b2:", row["b2_peak"], "z~", row["peak_z"])
         except Exception as exc:
@@ -102,4 +185,30 @@ def main(glob_pattern=DEFAULT_GLOB_PATTERN, out_csv=DEFAULT_SUMMARY,
 
 
 if __name__ == "__main__":
-    main()
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[2])
+    ap.add_argument("--glob_pattern", "--glob-pattern", default=str(DEFAULT_GLOB_PATTERN))
+    ap.add_argument("--out_csv", "--out-csv", default=str(DEFAULT_SUMMARY))
+    ap.add_argument("--outdir", default=str(DEFAULT_OUTDIR))
+    ap.add_argument("--seglen", type=int, default=4096)
+    ap.add_argument("--step", type=int, default=None)
+    ap.add_argument("--B", type=int, default=50, help="number of surrogates (cap for sequential)")
+    ap.add_argument("--f1-range", type=float, nargs=2, default=None, metavar=("LO", "HI"),
+                    help="restrict f1 to [LO, HI] Hz")
+    ap.add_argument("--f2-range", type=float, nargs=2, default=None, metavar=("LO", "HI"),
+                    help="restrict f2 to [LO, HI] Hz")
+    ap.add_argument("--mode", choices=("plane", "slice"), default="plane")
+    ap.add_argument("--significance", choices=("surrogate", "sequential", "evd", "analytic"),
+                    default="surrogate")
+    add_budget_args(ap)
+    add_precision_arg(ap)
+    ap.add_argument("--surrogate-workers", type=int, default=None,
+                    help="processes for the surrogate null (results do not depend on this)")
+    ap.add_argument("--surrogate-method", choices=("phase", "iaaft"), default="phase",
+                    help="iaaft also keeps the amplitude distribution (e.g. Poisson counts)")
+    a = ap.parse_args()
+    main(a.glob_pattern, a.out_csv, a.outdir, seglen=a.seglen, step=a.step, B=a.B,
+         f1_range=a.f1_range, f2_range=a.f2_range, mode=a.mode,
+         significance=a.significance, precision=a.precision, surrogate_workers=a.surrogate_workers,
+         surrogate_method=a.surrogate_method,
+         mem_budget=None if a.mem_budget is None else int(a.mem_budget * 2**30),
+         on_over=a.on_over_budget, memmap=a.memmap)
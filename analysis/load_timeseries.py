@@ -8,7 +8,11 @@ import numpy as np
 import pandas as pd
 from typing import Tuple, List
 
-def load_timeseries(path: str):
+def load_timeseries(path: str, dtype=float):
+    """
+    Returns t (float64), X (N, C) as dtype (e.g. np.float32 for single-precision
+    analysis) and the column names.
+    """
     ext = os.path.splitext(path)[1].lower()
     if ext == ".csv":
         df = pd.read_csv(path)
@@ -24,13 +28,13 @@ def load_timeseries(path: str):
         xcols = [c for c in cols if c != tcol]
         if not xcols:
             raise ValueError("CSV must contain at least one data column besides time.")
-        X = df[xcols].to_numpy(dtype=float)
+        X = df[xcols].to_numpy(dtype=dtype)
         return t, X, xcols
     elif ext == ".json":
         with open(path, "r") as f:
             obj = json.load(f)
         t = np.asarray(obj["time"], dtype=float)
-        X = np.asarray(obj["data"], dtype=float)
+        X = np.asarray(obj["data"], dtype=dtype)
         if X.ndim == 1:
             X = X[:,None]
         colnames = obj.get("colnames", [f"ch{i+1}" for i in range(X.shape[1])])
@@ -38,7 +42,7 @@ def load_timeseries(path: str):
     elif ext == ".npz":
         npz = np.load(path)
         t = np.asarray(npz["time"], dtype=float)
-        X = np.asarray(npz["data"], dtype=float)
+        X = np.asarray(npz["data"], dtype=dtype)
         if X.ndim == 1:
             X = X[:,None]
         colnames = [f"ch{i+1}" for i in range(X.shape[1])]
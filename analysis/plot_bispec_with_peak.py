@@ -1,12 +1,27 @@
 """
 analysis/plot_bispec_with_peak.py
-Plot bicoherence heatmap with peak annotation and sum-frequency line.
+Plot bicoherence heatmap with peak annotation and sum-frequency line,
+or the 1-D profile along a sum line from sum_frequency_bicoherence, or the
+sparse candidate pairs from peak_guided_bicoherence.
 """
 import os, numpy as np, matplotlib.pyplot as plt
+from analysis.bispec_peaks import bifrequency_axes
+
+def block_max(b2, max_px=1024):
+    """Block maxima of a dense (or memmap) plane, at most max_px per axis: images stay small, peaks survive."""
+    n0, n1 = b2.shape
+    s0, s1 = -(-n0 // max_px), -(-n1 // max_px)
+    if s0 == s1 == 1:
+        return np.asarray(b2)
+    cols = np.arange(0, n1, s1)
+    return np.array([np.maximum.reduceat(np.max(b2[r:r + s0], axis=0), cols) for r in range(0, n0, s0)])
 
 def plot(f, b2, peak, f3_est=None, outpng="bicoherence_annotated.png"):
+    """f is the full rfft axis or the (f1_axis, f2_axis) pair of an ROI sub-grid."""
+    f1, f2 = bifrequency_axes(f)
     plt.figure()
-    plt.imshow(b2, origin="lower", extent=[f[0], f[-1], f[0], f[-1]], aspect="auto")
+    # b2 rows index f1 (x axis), columns index f2 (y axis)
+    plt.imshow(block_max(b2).T, origin="lower", extent=[f1[0], f1[-1], f2[0], f2[-1]], aspect="auto")
     plt.xlabel("f1 (Hz)"); plt.ylabel("f2 (Hz)"); plt.title("Bicoherence with peak")
     cbar = plt.colorbar(); cbar.set_label("b^2")
     # Peak
@@ -14,9 +29,32 @@ def plot(f, b2, peak, f3_est=None, outpng="bicoherence_annotated.png"):
     plt.text(peak["f1"], peak["f2"], f'  peak={peak["b2_peak"]:.3f}', color="white")
     # Sum line (optional): f1+f2 = f3_est
     if f3_est is not None:
-        xs = np.linspace(f[0], f[-1], 400)
+        xs = np.linspace(f1[0], f1[-1], 400)
         ys = f3_est - xs
         plt.plot(xs, ys, linestyle="--")
+        plt.ylim(f2[0], f2[-1])
+    plt.tight_layout()
+    os.makedirs(os.path.dirname(outpng), exist_ok=True)
+    plt.savefig(outpng, dpi=160); plt.close()
+
+def plot_slice(f1, b2, peak, f3, outpng="bicoherence_slice.png"):
+    plt.figure()
+    plt.plot(f1, b2)
+    plt.xlabel("f1 (Hz)"); plt.ylabel("b^2"); plt.title(f"Bicoherence along f1+f2={f3:.3f} Hz")
+    plt.scatter([peak["f1"]], [peak["b2_peak"]], s=60, marker="x")
+    plt.text(peak["f1"], peak["b2_peak"], f'  peak={peak["b2_peak"]:.3f}')
+    plt.tight_layout()
+    os.makedirs(os.path.dirname(outpng), exist_ok=True)
+    plt.savefig(outpng, dpi=160); plt.close()
+
+def plot_sparse(f, b2, peak, outpng="bicoherence_sparse.png"):
+    """Scatter of the evaluated (f1, f2) candidates of a sparse PackedBispectrum, coloured by b2."""
+    plt.figure()
+    plt.scatter(f[b2.i], f[b2.j], c=b2.values, s=12, marker="s")
+    plt.xlabel("f1 (Hz)"); plt.ylabel("f2 (Hz)"); plt.title("Bicoherence at candidate pairs")
+    cbar = plt.colorbar(); cbar.set_label("b^2")
+    plt.scatter([peak["f1"]], [peak["f2"]], s=60, marker="x", color="k")
+    plt.text(peak["f1"], peak["f2"], f'  peak={peak["b2_peak"]:.3f}')
     plt.tight_layout()
     os.makedirs(os.path.dirname(outpng), exist_ok=True)
     plt.savefig(outpng, dpi=160); plt.close()
@@ -1,16 +1,152 @@
 """
 analysis/plv_pac.py
 Utilities to compute PLV (phase-locking value) and PAC (Tort modulation index).
+
+Band-pass filters are second-order sections (stable for narrow low bands such
+as 0.2-0.5 Hz at fs=2000, where the (b, a) form is not), designed once per
+(fs, band, order). Passing the same dict as cache= to several plv/pac_tort
+calls band-passes and Hilbert-transforms each (signal, band) only once.
+
+method="fft" replaces sosfiltfilt+hilbert by a frequency-domain bank
+(analytic_bank): one forward FFT per channel, smooth zero-phase band masks on
+the positive frequencies and one inverse FFT per band that is already the
+analytic signal; with a cache the channel FFT is shared by all its bands.
+comodulogram() evaluates pac_tort over a whole phase x amplitude band grid and
+plv_batch() plv over many channel pairs, bands and stacked simulations at once.
+phase_bin() and tort_mi() are the binning and MI steps of pac_tort, for callers
+that bin amplitudes themselves (e.g. bootstrap replicates).
+
+multirate=True filters a band at a reduced rate chosen by decimation_plan()
+(anti-alias decimate, band-pass and Hilbert there, resample back to fs), which
+is cheaper and better conditioned for low bands such as 0.2-0.5 Hz.
 """
+from functools import lru_cache
+
 import numpy as np
-from scipy.signal import butter, filtfilt, hilbert
+from scipy.fft import ifft, rfft, rfftfreq
+from scipy.signal import butter, decimate, hilbert, sosfiltfilt
 
-def bandpass(data, fs, f_lo, f_hi, order=4):
+_METHODS = ("filtfilt", "fft")
+
+@lru_cache(maxsize=None)
+def bandpass_sos(fs, f_lo, f_hi, order=4):
+    """Butterworth band-pass as second-order sections, cached by (fs, band, order); do not modify."""
     ny = 0.5*fs
     lo = max(1e-6, f_lo/ny)
     hi = min(0.999, f_hi/ny)
-    b, a = butter(order, [lo, hi], btype='bandpass')
-    return filtfilt(b, a, data, axis=0)
+    return butter(order, [lo, hi], btype='bandpass', output='sos')
+
+def decimation_plan(fs, f_hi, n, oversample=8.0, min_len=64):
+    """
+    Automatic rate for a band reaching f_hi Hz in n samples: the largest factor q
+    keeping fs/q >= oversample*f_hi and n/q >= min_len, built from decimate() stages
+    of at most 10 (so q may fall short of that bound). Returns {"q", "stages", "fs"}.
+    """
+    bound = int(min(fs/(oversample*f_hi), n/min_len))
+    stages, q = [], 1
+    while 2*q <= bound:
+        stages.append(min(10, bound//q))
+        q *= stages[-1]
+    return {"q": q, "stages": stages, "fs": fs/q}
+
+def _downsample(data, stages):
+    for s in stages:
+        data = decimate(data, s, ftype='fir', axis=0, zero_phase=True)
+    return data
+
+def _upsample(z, q, n):
+    # analytic signal at fs/q -> n samples at fs: unwrapped phase and envelope are smooth,
+    # so both are interpolated linearly (extrapolated over the last < q samples)
+    if q == 1:
+        return z
+    ph, amp = np.unwrap(np.angle(z), axis=0), np.abs(z)
+    pos = np.arange(n)/q
+    k = np.clip(pos.astype(int), 0, len(z) - 2)
+    w = (pos - k).reshape((-1,) + (1,)*(z.ndim - 1))
+    lerp = lambda v: v[k]*(1 - w) + v[k + 1]*w
+    return lerp(amp)*np.exp(1j*lerp(ph))
+
+def bandpass_multirate(data, fs, f_lo, f_hi, order=4, interp=True, analytic=False):
+    """
+    bandpass() (hilbert() too if analytic) at the decimation_plan() rate: zero-phase
+    FIR decimation, then the band-pass there. Returns (y, plan); y is brought back to
+    len(data) samples at fs through the phase/envelope of its analytic signal unless
+    interp=False, in which case it stays at plan["fs"].
+    """
+    plan = decimation_plan(fs, f_hi, len(data))
+    y = sosfiltfilt(bandpass_sos(float(plan["fs"]), float(f_lo), float(f_hi), order),
+                    _downsample(data, plan["stages"]), axis=0)
+    if interp and plan["q"] > 1:
+        y = _upsample(hilbert(y, axis=0), plan["q"], len(data))
+        return (y if analytic else y.real), plan
+    return (hilbert(y, axis=0) if analytic else y), plan
+
+def bandpass(data, fs, f_lo, f_hi, order=4, multirate=False):
+    if multirate:
+        return bandpass_multirate(data, fs, f_lo, f_hi, order)[0]
+    return sosfiltfilt(bandpass_sos(float(fs), float(f_lo), float(f_hi), order), data, axis=0)
+
+def _band_mask(f, f_lo, f_hi, edge):
+    # 1 in [f_lo, f_hi], raised-cosine roll-off over edge Hz on both sides, DC excluded
+    d = np.maximum(f_lo - f, f - f_hi)
+    m = np.where(d <= 0, 1.0, 0.5*(1 + np.cos(np.pi*np.minimum(d/edge, 1.0))))
+    m[f == 0] = 0.0
+    return m
+
+def _spectrum(data, cache=None):
+    if cache is None:
+        return rfft(data, axis=0)
+    key = (id(data), "rfft")
+    if key not in cache:
+        cache[key] = (data, rfft(data, axis=0))
+    return cache[key][1]
+
+def analytic_bank(data, fs, bands, edge=None, cache=None):
+    """
+    Analytic signals of data (along axis 0) in each (f_lo, f_hi) of bands from one
+    forward FFT: the positive-frequency half times a zero-phase band mask with
+    raised-cosine edges edge Hz wide (default: a quarter of the band width, at least
+    two bins), doubled, and one inverse FFT per band. cache shares the FFT as in
+    analytic_signal.
+    """
+    x = np.asarray(data)
+    n = x.shape[0]
+    X = _spectrum(data, cache)
+    f = rfftfreq(n, d=1.0/fs)
+    w = np.full(f.size, 2.0)
+    if n % 2 == 0:
+        w[-1] = 1.0                            # Nyquist bin, as in hilbert()
+    shape = (-1,) + (1,)*(x.ndim - 1)
+    out = []
+    for f_lo, f_hi in bands:
+        e = max(0.25*(f_hi - f_lo), 2.0*fs/n) if edge is None else edge
+        Z = np.zeros((n,) + x.shape[1:], dtype=X.dtype)
+        Z[:f.size] = X*(w*_band_mask(f, f_lo, f_hi, e)).reshape(shape)
+        out.append(ifft(Z, axis=0))
+    return out
+
+def analytic_signal(data, fs, f_lo, f_hi, order=4, cache=None, method="filtfilt", multirate=False):
+    """
+    hilbert(bandpass(data)), or with method="fft" the analytic_bank() band. multirate
+    (filtfilt only) runs both at the decimated rate and resamples the analytic signal
+    back to fs. With a dict as cache the result is kept under (id(data), fs, band, order, method, multirate),
+    together with data itself so the id stays valid; reuse the same array object
+    to hit it.
+    """
+    if method not in _METHODS:
+        raise ValueError(f"Unknown method: {method!r} (use 'filtfilt' or 'fft').")
+    def compute():
+        if method == "fft":
+            return analytic_bank(data, fs, [(f_lo, f_hi)], cache=cache)[0]
+        if multirate:
+            return bandpass_multirate(data, fs, f_lo, f_hi, order, analytic=True)[0]
+        return hilbert(bandpass(data, fs, f_lo, f_hi, order), axis=0)
+    if cache is None:
+        return compute()
+    key = (id(data), float(fs), float(f_lo), float(f_hi), order, method, bool(multirate) and method != "fft")
+    if key not in cache:
+        cache[key] = (data, compute())
+    return cache[key][1]
 
 def phase(data):
     """Instantaneous phase via Hilbert transform."""
@@ -22,42 +158,84 @@ def amplitude_envelope(data):
     analytic = hilbert(data, axis=0)
     return np.abs(analytic)
 
-def plv(sig1, sig2, fs, f_lo, f_hi):
+def plv(sig1, sig2, fs, f_lo, f_hi, cache=None, method="filtfilt", multirate=False):
     """PLV between two signals in a band."""
-    x1 = bandpass(sig1, fs, f_lo, f_hi)
-    x2 = bandpass(sig2, fs, f_lo, f_hi)
-    ph1 = phase(x1)
-    ph2 = phase(x2)
-    dphi = np.unwrap(ph1 - ph2)
-    return float(np.abs(np.exp(1j*dphi)).mean())
+    ph1 = np.angle(analytic_signal(sig1, fs, f_lo, f_hi, cache=cache, method=method, multirate=multirate))
+    ph2 = np.angle(analytic_signal(sig2, fs, f_lo, f_hi, cache=cache, method=method, multirate=multirate))
+    return float(np.abs(np.exp(1j*(ph1 - ph2)).mean()))
+
+def plv_batch(X, fs, bands, pairs, method="filtfilt", multirate=False):
+    """
+    PLV for every band in bands and channel pair (a, b) in pairs of X, either (N, C)
+    or a stack of B simulations (N, C, B), as a (len(bands), len(pairs)) or
+    (len(bands), len(pairs), B) array; entry [k, p] equals plv(X[:, a], X[:, b], fs,
+    *bands[k]). Per band, the columns used by any pair (all simulations) are
+    band-passed and Hilbert-transformed in one call along axis 0.
+    """
+    X = np.asarray(X)
+    cols, idx = np.unique(np.asarray(pairs).reshape(-1, 2), return_inverse=True)
+    idx = idx.reshape(-1, 2)
+    sub = X[:, cols]
+    out = np.empty((len(bands), len(idx)) + X.shape[2:])
+    for k, (f_lo, f_hi) in enumerate(bands):
+        z = analytic_signal(sub, fs, f_lo, f_hi, method=method, multirate=multirate)
+        u = z / np.maximum(np.abs(z), 1e-300)
+        out[k] = np.abs(np.einsum("tp...,tp...->p...", u[:, idx[:, 0]], np.conj(u[:, idx[:, 1]]))) / len(X)
+    return out
 
-def pac_tort(phase_sig, amp_sig, fs, f_phase, f_amp, n_bins=18):
+def pac_tort(phase_sig, amp_sig, fs, f_phase, f_amp, n_bins=18, cache=None, method="filtfilt",
+             multirate=False):
     """
     Tort modulation index: phase from low band, amplitude envelope from high band.
     Returns MI in [0, ~0.3] typically.
     """
-    lp = bandpass(phase_sig, fs, f_phase[0], f_phase[1])
-    hp = bandpass(amp_sig, fs, f_amp[0], f_amp[1])
-    ph = phase(lp)
-    amp = amplitude_envelope(hp)
-    # Bin amplitude by phase
+    kw = dict(cache=cache, method=method, multirate=multirate)
+    ph = np.angle(analytic_signal(phase_sig, fs, f_phase[0], f_phase[1], **kw))
+    amp = np.abs(analytic_signal(amp_sig, fs, f_amp[0], f_amp[1], **kw))
+    return float(tort_mi(_amp_by_phase(ph.ravel(), amp.reshape(-1, 1), n_bins), n_bins)[0])
+
+def phase_bin(ph, n_bins):
+    """Index 0 .. n_bins-1 of the equal-width bin of [-pi, pi] holding each phase."""
     bins = np.linspace(-np.pi, np.pi, n_bins+1)
-    idx = np.digitize(ph.ravel(), bins) - 1
-    idx = np.clip(idx, 0, n_bins-1)
-    mean_amp = np.zeros(n_bins)
-    counts = np.zeros(n_bins)
-    for i in range(n_bins):
-        sel = (idx == i)
-        if np.any(sel):
-            mean_amp[i] = amp.ravel()[sel].mean()
-            counts[i] = sel.sum()
-        else:
-            mean_amp[i] = 0.0
+    return np.clip(np.digitize(ph, bins) - 1, 0, n_bins-1)
+
+def _amp_by_phase(ph, amps, n_bins):
+    """Mean of each column of amps (N, A) per phase bin of ph (N,), as (A, n_bins); 0 for empty bins."""
+    idx = phase_bin(ph, n_bins)
+    counts = np.bincount(idx, minlength=n_bins)
+    # one weighted bincount for all columns: column a uses bins a*n_bins .. (a+1)*n_bins-1
+    keys = (idx[:, None] + n_bins*np.arange(amps.shape[1])).ravel()
+    sums = np.bincount(keys, weights=amps.ravel(), minlength=n_bins*amps.shape[1]).reshape(-1, n_bins)
+    return np.divide(sums, counts, out=np.zeros_like(sums), where=counts > 0)
+
+def tort_mi(mean_amp, n_bins):
+    """Tort MI of mean amplitudes per phase bin (..., n_bins), reduced over the last axis."""
     # Normalize to probability distribution
-    p = mean_amp / (mean_amp.sum() + 1e-12)
+    p = mean_amp / (mean_amp.sum(axis=-1, keepdims=True) + 1e-12)
     # Modulation index (KL divergence from uniform, normalized by log(n_bins))
     uniform = 1.0/n_bins
     with np.errstate(divide='ignore', invalid='ignore'):
-        kl = np.nansum(p * (np.log(p + 1e-12) - np.log(uniform)))
-    mi = kl / np.log(n_bins)
-    return float(max(0.0, mi))
+        kl = np.nansum(p * (np.log(p + 1e-12) - np.log(uniform)), axis=-1)
+    return np.maximum(0.0, kl / np.log(n_bins))
+
+def band_grid(f_lo, f_hi, n, width):
+    """n bands of the given width (Hz) with centers evenly spaced over [f_lo, f_hi]."""
+    return [(c - width/2, c + width/2) for c in np.linspace(f_lo, f_hi, n)]
+
+def comodulogram(phase_sig, amp_sig, fs, phase_bands, amp_bands, n_bins=18, cache=None, method="filtfilt",
+                 multirate=False):
+    """
+    Tort MI for every (phase band, amplitude band) pair as a (len(phase_bands),
+    len(amp_bands)) array; entry [p, a] equals pac_tort(phase_sig, amp_sig, fs,
+    phase_bands[p], amp_bands[a], n_bins). Each band's analytic signal is computed
+    once (shared through cache, so phase_sig may be amp_sig, e.g. a sweep center
+    trace or one JPC channel) and each phase band bins all amplitude envelopes with
+    a single weighted np.bincount.
+    """
+    kw = dict(cache={} if cache is None else cache, method=method, multirate=multirate)
+    amps = np.column_stack([np.abs(analytic_signal(amp_sig, fs, lo, hi, **kw)).ravel() for lo, hi in amp_bands])
+    mi = np.empty((len(phase_bands), len(amp_bands)))
+    for k, (lo, hi) in enumerate(phase_bands):
+        ph = np.angle(analytic_signal(phase_sig, fs, lo, hi, **kw)).ravel()
+        mi[k] = tort_mi(_amp_by_phase(ph, amps, n_bins), n_bins)
+    return mi
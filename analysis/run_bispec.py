@@ -9,7 +9,10 @@ import matplotlib.pyplot as plt
 import numpy as np
 
 from analysis.load_timeseries import load_timeseries
-from analysis.bispectrum import bispectrum, cross_bispectrum
+from analysis.bispectrum import bispectrum, cross_bispectrum, PackedBispectrum, SegmentSpectra
+from analysis.bispec_peaks import bifrequency_axes
+from analysis.plot_bispec_with_peak import block_max
+from analysis.bispec_plan import preflight, describe, add_budget_args, add_precision_arg
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
 OUT_DIR = PROJECT_ROOT / "out"
@@ -19,8 +22,9 @@ DEFAULT_OUTDIR = OUT_DIR / "bispec_plots"
 def plot_bicoherence(f, b2, outpng):
     outpng = Path(outpng)
     outpng.parent.mkdir(parents=True, exist_ok=True)
+    f1, f2 = bifrequency_axes(f)
     plt.figure()
-    plt.imshow(b2, origin="lower", extent=[f[0], f[-1], f[0], f[-1]], aspect="auto")
+    plt.imshow(block_max(b2).T, origin="lower", extent=[f1[0], f1[-1], f2[0], f2[-1]], aspect="auto")
     plt.xlabel("f1 (Hz)")
     plt.ylabel("f2 (Hz)")
     plt.title("Bicoherence b^2(f1,f2)")
@@ -30,6 +34,23 @@ def plot_bicoherence(f, b2, outpng):
     plt.close()
 
 
+def save_bispec(path, f, **arrays):
+    """
+    Write f-axes plus bispectral arrays to a compressed npz.
+    PackedBispectrum values are stored as 1-D arrays with their shared (i, j)
+    pair index, shape, offset and symmetric flag so they can be re-expanded.
+    Arrays that already live in .npy memmaps are stored as their file name.
+    """
+    f1, f2 = bifrequency_axes(f)
+    out = {"f": f1, "f2": f2}
+    for name, arr in arrays.items():
+        if isinstance(arr, PackedBispectrum):
+            out.update(i=arr.i, j=arr.j, shape=arr.shape, offset=arr.offset, symmetric=arr.symmetric)
+            arr = arr.values
+        out[name] = Path(arr.filename).name if isinstance(arr, np.memmap) else arr
+    np.savez_compressed(path, **out)
+
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--path", required=True)
@@ -37,12 +58,30 @@ def main():
     ap.add_argument("--seglen", type=int, default=2048)
     ap.add_argument("--step", type=int, default=None)
     ap.add_argument("--channels", type=str, default="")
+    ap.add_argument("--f1-range", type=float, nargs=2, default=None, metavar=("LO", "HI"),
+                    help="restrict f1 to [LO, HI] Hz")
+    ap.add_argument("--f2-range", type=float, nargs=2, default=None, metavar=("LO", "HI"),
+                    help="restrict f2 to [LO, HI] Hz")
+    ap.add_argument("--packed", action="store_true",
+                    help="compute and store only the non-redundant principal domain")
+    ap.add_argument("--workers", type=int, default=None,
+                    help="threads for the bifrequency tiles (results identical to serial)")
+    ap.add_argument("--method", choices=("segment", "direct"), default="segment",
+                    help="segment-averaged estimator or frequency-smoothing (direct) estimator; "
+                         "direct is much slower at the default --smooth, which sets its cost")
+    ap.add_argument("--smooth", type=int, default=None,
+                    help="direct method: kernel width in fine bins (default matches seglen); "
+                         "cost grows as smooth^2 per bin, variance falls as it widens")
+    ap.add_argument("--kernel", choices=("box", "hann"), default="box",
+                    help="direct method: bifrequency smoothing kernel")
+    add_budget_args(ap)
+    add_precision_arg(ap)
     ap.add_argument("--outdir", type=str, default=str(DEFAULT_OUTDIR))
     args = ap.parse_args()
 
     outdir = Path(args.outdir)
     outdir.mkdir(parents=True, exist_ok=True)
-    t, X, cols = load_timeseries(args.path)
+    t, X, cols = load_timeseries(args.path, dtype=args.precision)
     if args.fs is None:
         dt = np.median(np.diff(t))
         fs = 1.0 / dt
@@ -60,21 +99,41 @@ def main():
     else:
         sel = list(range(min(3, X.shape[1])))
 
-    f, S3, b2 = bispectrum(X[:, sel[0]], fs, seglen=args.seglen, step=args.step)
-    np.savez(outdir / "bispec_uni.npz", f=f, S3=S3, b2=b2)
-    plot_bicoherence(f, b2, outdir / "bicoherence_uni.png")
+    opts = dict(f1_range=args.f1_range, f2_range=args.f2_range, packed=args.packed, workers=args.workers,
+                precision=args.precision)
+    memmap = {}
+    if args.method == "segment":
+        budget = None if args.mem_budget is None else int(args.mem_budget * 2**30)
+        plan = preflight(len(X), args.seglen, budget=budget, on_over=args.on_over_budget,
+                         step=args.step, channels=3 if len(sel) >= 3 else 1, fs=fs,
+                         memmap=args.memmap, **opts)
+        print("Plan:", describe(plan))
+        opts.update(f1_range=plan["f1_range"], f2_range=plan["f2_range"], packed=plan["packed"])
+        if plan["memmap"]:
+            memmap = {"uni": str(outdir / "bispec_uni"), "cross": str(outdir / "bispec_cross")}
+    if args.method == "direct":
+        opts.update(method="direct", smooth=args.smooth, kernel=args.kernel, fs=fs, seglen=args.seglen)
+        specs = [X[:, c] for c in sel[:3]]
+    else:
+        # each channel is segmented and transformed once, shared by uni and cross
+        specs = [SegmentSpectra(X[:, c], fs, args.seglen, args.step, precision=args.precision)
+                 for c in sel[:3]]
+    # the image is a dense in-memory copy of the plane: skip it for packed/memmap results
+    plot = not (opts["packed"] or memmap)
+    if not plot:
+        print("Packed/memmap plane: skipping the dense bicoherence images.")
+    f, S3, b2 = bispectrum(specs[0], memmap=memmap.get("uni"), **opts)
+    save_bispec(outdir / "bispec_uni.npz", f, S3=S3, b2=b2)
+    if plot:
+        plot_bicoherence(f, b2, outdir / "bicoherence_uni.png")
+    # the plan budgets one S3/b2 pair: release the uni planes before the cross pair
+    del S3, b2
 
     if len(sel) >= 3:
-        f, Sxyz, b2xyz = cross_bispectrum(
-            X[:, sel[0]],
-            X[:, sel[1]],
-            X[:, sel[2]],
-            fs,
-            seglen=args.seglen,
-            step=args.step,
-        )
-        np.savez(outdir / "bispec_cross.npz", f=f, Sxyz=Sxyz, b2=b2xyz)
-        plot_bicoherence(f, b2xyz, outdir / "bicoherence_cross.png")
+        f, Sxyz, b2xyz = cross_bispectrum(*specs, memmap=memmap.get("cross"), **opts)
+        save_bispec(outdir / "bispec_cross.npz", f, Sxyz=Sxyz, b2=b2xyz)
+        if plot:
+            plot_bicoherence(f, b2xyz, outdir / "bicoherence_cross.png")
 
     print("Wrote bicoherence outputs to", outdir)
 
@@ -29,6 +29,7 @@ def main(cfg_path=DEFAULT_CFG):
     channels = ",".join(cfg.get("channels", []))
     seglen = str(cfg.get("seglen", 4096))
     step = cfg.get("step", None)
+    precision = cfg.get("precision", None)
     outdir = _resolve_path(cfg.get("outdir", DEFAULT_OUTDIR))
     outdir.mkdir(parents=True, exist_ok=True)
 
@@ -47,6 +48,8 @@ def main(cfg_path=DEFAULT_CFG):
         cmd += ["--channels", channels]
     if step is not None:
         cmd += ["--step", str(step)]
+    if precision is not None:
+        cmd += ["--precision", precision]
     print("Running:", " ".join(cmd))
     subprocess.run(cmd, check=False)
 
@@ -5,12 +5,12 @@ Convert time-tag event lists to binned time series and compute bicoherence.
 import argparse
 from pathlib import Path
 
-import numpy as np
-
 from analysis.event_binning import load_event_times, bin_events
 from analysis.bispectrum import cross_bispectrum
 from analysis.plot_bispec_with_peak import plot as plot_annot
 from analysis.bispec_peaks import find_bicoherence_peak
+from analysis.bispec_plan import preflight, describe, add_budget_args, add_precision_arg
+from analysis.run_bispec import save_bispec
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
 OUT_DIR = PROJECT_ROOT / "out"
@@ -23,19 +23,40 @@ def main():
     ap.add_argument("--fs", type=float, default=1e6, help="binning sample rate (Hz)")
     ap.add_argument("--T", type=float, default=None, help="duration seconds; if omitted, derived")
     ap.add_argument("--seglen", type=int, default=131072, help="FFT length for bispectrum")
+    ap.add_argument("--f1-range", type=float, nargs=2, default=None, metavar=("LO", "HI"),
+                    help="restrict f1 to [LO, HI] Hz (keeps large seglen tractable)")
+    ap.add_argument("--f2-range", type=float, nargs=2, default=None, metavar=("LO", "HI"),
+                    help="restrict f2 to [LO, HI] Hz")
+    ap.add_argument("--workers", type=int, default=None,
+                    help="threads for the bifrequency tiles (results identical to serial)")
+    add_budget_args(ap)
+    add_precision_arg(ap)
     ap.add_argument("--outdir", type=str, default=str(DEFAULT_OUTDIR))
     args = ap.parse_args()
 
     outdir = Path(args.outdir)
     outdir.mkdir(parents=True, exist_ok=True)
     ch_times = load_event_times(args.path)
-    t, X = bin_events(ch_times, fs=args.fs, T=args.T)
+    t, X = bin_events(ch_times, fs=args.fs, T=args.T, dtype=args.precision)
     fs = args.fs
 
-    f, Sxyz, b2 = cross_bispectrum(X[:, 0], X[:, 1], X[:, 2], fs, seglen=args.seglen, step=None)
+    # checked before anything is allocated: the default seglen gives a ~100 GB dense plane
+    budget = None if args.mem_budget is None else int(args.mem_budget * 2**30)
+    plan = preflight(len(X), args.seglen, budget=budget, on_over=args.on_over_budget, channels=3, fs=fs,
+                     f1_range=args.f1_range, f2_range=args.f2_range, memmap=args.memmap,
+                     workers=args.workers, precision=args.precision)
+    print("Plan:", describe(plan))
+
+    f, Sxyz, b2 = cross_bispectrum(X[:, 0], X[:, 1], X[:, 2], fs, seglen=args.seglen, step=None,
+                                   f1_range=plan["f1_range"], f2_range=plan["f2_range"],
+                                   packed=plan["packed"], workers=args.workers, precision=args.precision,
+                                   memmap=str(outdir / "timetag_bispec") if plan["memmap"] else None)
     peak = find_bicoherence_peak(b2, f)
-    np.savez(outdir / "timetag_bispec.npz", f=f, b2=b2, peak=list(peak.items()))
-    plot_annot(f, b2, peak, f3_est=None, outpng=str(outdir / "timetag_bicoherence.png"))
+    save_bispec(outdir / "timetag_bispec.npz", f, b2=b2, peak=list(peak.items()))
+    if plan["packed"] or plan["memmap"]:
+        print("Packed/memmap plane: skipping the dense hotspot image.")
+    else:
+        plot_annot(f, b2, peak, f3_est=None, outpng=str(outdir / "timetag_bicoherence.png"))
     print("Peak:", peak)
 
 
@@ -2,10 +2,14 @@
 analysis/spdc_batch.py
 Batch analysis for SPDC time-tag JSON/CSV/NPZ files:
 - Bin event times to counts
-- Compute cross-bicoherence and surrogate z-scores
+- Compute cross-bicoherence (full plane, or sparse around spectral peaks) and
+  surrogate z-scores (all B, or significance="sequential" stopping early),
+  (significance="evd") Gumbel-fit p-values from a few surrogates, or
+  (significance="analytic") chi-square null p-values
 - Compute triad lock-phase stability on binned counts
 - Save summary CSV and annotated hotspot plots
 """
+import argparse
 import glob
 from pathlib import Path
 
@@ -14,11 +18,12 @@ import numpy as np
 import pandas as pd
 
 from analysis.event_binning import load_event_times, bin_events
-from analysis.bispectrum import cross_bispectrum
+from analysis.bispectrum import cross_bispectrum, peak_guided_bicoherence, batch_max_bicoherence, SegmentSpectra
+from analysis.bispec_plan import preflight_batch, describe, add_budget_args, add_precision_arg
 from analysis.bispec_peaks import find_bicoherence_peak, dominant_freq
-from analysis.surrogates import phase_randomize, peak_zscore
+from analysis.surrogates import run_surrogates, peak_zscore, evd_peak_test, sequential_peak_test, analytic_peak_test, analytic_bins
 from analysis.triad_lock import triad_phase_lock, triad_phase_lock_sliding, coherence_time
-from analysis.plot_bispec_with_peak import plot as plot_annot
+from analysis.plot_bispec_with_peak import plot as plot_annot, plot_sparse
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
 DATA_DIR = PROJECT_ROOT / "data"
@@ -29,27 +34,94 @@ DEFAULT_GLOB_PATTERN = DATA_DIR / "spdc_detuned_run_*.json"
 DEFAULT_SUMMARY = OUT_DIR / "spdc_batch_summary.csv"
 
 
+def sparse_null_batch(xs, ys, zs, fs, seglen, top_k=3, radius=2, precision="float64"):
+    """Peak-guided b2 maximum of each surrogate row (module level so process workers can run it)."""
+    return [peak_guided_bicoherence(a, b, c, fs, seglen, top_k=top_k, radius=radius,
+                                    precision=precision)[2].max() for a, b, c in zip(xs, ys, zs)]
+
+
 def analyze_file(path, outdir=DEFAULT_OUTDIR, fs_bin=1e6, seglen=131072, B=50,
-                 bw=1.0, win_s=0.5, step_s=0.1, seed=7):
+                 bw=1.0, win_s=0.5, step_s=0.1, seed=7, f1_range=None, f2_range=None,
+                 sparse=False, top_k=3, radius=2, significance="surrogate", precision="float64",
+                 surrogate_chunk=8, alpha=0.05, seq_batch=5, seq_min=10, surrogate_workers=None,
+                 surrogate_method="phase", evd_B=16, mem_budget=None, on_over="downgrade", memmap=False):
+    """
+    Surrogates are generated surrogate_chunk at a time; the dense null is one batched job per chunk.
+    Chunks run on surrogate_workers processes; results do not depend on the worker count.
+    surrogate_method="iaaft" keeps the Poisson count distribution of each channel (IAAFT).
+    precision="float32" bins counts and runs the bicoherence (data and surrogates) in single precision.
+    significance="sequential" draws seq_batch surrogates at a time and stops once the p-value
+    interval is clear of alpha (at least seq_min, at most B); n_surrogates records the count.
+    significance="evd" fits a Gumbel law to min(B, evd_B) surrogate maxima (evd_peak_test)
+    and adds the fit diagnostics as evd_* columns.
+    significance="analytic" replaces the B surrogates by the chi-square max-statistic null
+    over the interior bins (analytic_bins; DC/Nyquist-edge bins are not tested).
+    sparse=True evaluates b2 only around the top_k spectral peaks of each channel
+    (+/- radius bins) for the data and the surrogates, which keeps full seglen
+    resolution affordable; the candidate table is written next to the plot.
+    The dense plane plus surrogate_chunk triples per worker are checked against
+    mem_budget bytes (bispec_plan.preflight_batch) before the plane is allocated; over
+    budget the chunk shrinks, then the plane goes packed/memmap/narrower ROI, or
+    on_over="refuse" raises MemoryError. Packed or memmapped planes are not plotted.
+    """
     outdir = Path(outdir)
     outdir.mkdir(parents=True, exist_ok=True)
     ch_times = load_event_times(path)
-    t, X = bin_events(ch_times, fs=fs_bin, T=None, t0=None)
+    t, X = bin_events(ch_times, fs=fs_bin, T=None, t0=None, dtype=precision)
     fs = fs_bin
 
-    f, Sxyz, b2 = cross_bispectrum(X[:, 0], X[:, 1], X[:, 2], fs, seglen=seglen, step=None)
+    roi = dict(f1_range=f1_range, f2_range=f2_range)
+    surrogates = significance in ("surrogate", "sequential", "evd")
+    chunk = seq_batch if significance == "sequential" else surrogate_chunk
+    plan = {"packed": False, "memmap": False}
+    if not sparse:
+        # sparse candidate sets are small; the dense plane and batched null are planned
+        plan, chunk = preflight_batch(len(X), seglen, chunk if surrogates else 0, processes=surrogate_workers,
+                                      budget=mem_budget, on_over=on_over, fs=fs, memmap=memmap,
+                                      precision=precision, **roi)
+        print("Plan:", describe(plan))
+        roi = dict(f1_range=plan["f1_range"], f2_range=plan["f2_range"])
+    specs = [SegmentSpectra(X[:, c], fs, seglen, precision=precision) for c in range(3)]
+
+    def bicoherence(a, b, c):
+        if sparse:
+            return peak_guided_bicoherence(a, b, c, fs, seglen, top_k=top_k, radius=radius,
+                                           precision=precision)
+        return cross_bispectrum(a, b, c, fs, seglen=seglen, step=None, precision=precision,
+                                packed=plan["packed"], **roi,
+                                memmap=str(outdir / f"{Path(path).stem}_bispec") if plan["memmap"] else None)
+
+    f, Sxyz, b2 = bicoherence(*specs)
     peak = find_bicoherence_peak(b2, f)
 
-    rng = np.random.default_rng(seed)
-    null_peaks = []
-    for _ in range(B):
-        xs = phase_randomize(X[:, 0], seed=rng.integers(0, 1_000_000_000))
-        ys = phase_randomize(X[:, 1], seed=rng.integers(0, 1_000_000_000))
-        zs = phase_randomize(X[:, 2], seed=rng.integers(0, 1_000_000_000))
-        _, _, b2s = cross_bispectrum(xs, ys, zs, fs, seglen=seglen, step=None)
-        null_peaks.append(b2s.max())
-    zscore, pval, mu, sd = peak_zscore(peak["b2_peak"], null_peaks)
+    if significance == "analytic":
+        tested = analytic_bins(b2, f, fs_bin)
+        zscore, pval, mu, sd = analytic_peak_test(tested.max(initial=0.0), specs[0].nseg, tested.size)
+        n_used = 0
+    elif surrogates:
+        B = min(B, evd_B) if significance == "evd" else B
+        if sparse:
+            # candidate pairs follow each surrogate's own spectral peaks
+            evaluate, where = sparse_null_batch, dict(top_k=top_k, radius=radius)
+        else:
+            evaluate, where = batch_max_bicoherence, roi
+        nulls = run_surrogates(evaluate, [X[:, c] for c in range(3)], B, seed=seed, chunk=chunk,
+                               workers=surrogate_workers, method=surrogate_method, fs=fs,
+                               seglen=seglen, precision=precision, **where)
+        if significance == "sequential":
+            zscore, pval, mu, sd, n_used = sequential_peak_test(peak["b2_peak"], nulls, alpha=alpha, min_B=seq_min)
+        elif significance == "evd":
+            null_peaks = np.concatenate(list(nulls))
+            zscore, pval, mu, sd, fit = evd_peak_test(peak["b2_peak"], null_peaks)
+            n_used = len(null_peaks)
+        else:
+            null_peaks = np.concatenate(list(nulls))
+            zscore, pval, mu, sd = peak_zscore(peak["b2_peak"], null_peaks)
+            n_used = len(null_peaks)
+    else:
+        raise ValueError(f"Unknown significance: {significance!r} (use 'surrogate', 'sequential', 'evd' or 'analytic').")
 
+    # full-record spectra here: the 1 Hz triad-lock bands need finer bins than seglen gives
     f1_est = float(dominant_freq(X[:, 0], fs, nmax=1)[0][0])
     f2_est = float(dominant_freq(X[:, 1], fs, nmax=1)[0][0])
     L_static = triad_phase_lock(X[:, 0], X[:, 1], X[:, 2], fs, f1_est, f2_est, bw=bw)
@@ -67,7 +139,14 @@ def analyze_file(path, outdir=DEFAULT_OUTDIR, fs_bin=1e6, seglen=131072, B=50,
     coh_t = coherence_time(idxs, L_vals, thresh=0.5)
 
     outpng = outdir / f"{Path(path).stem}_bicoherence_cross_annot.png"
-    plot_annot(f, b2, peak, f3_est=None, outpng=str(outpng))
+    if sparse:
+        pd.DataFrame({"f1": f[b2.i], "f2": f[b2.j], "b2": b2.values}).to_csv(
+            outdir / f"{Path(path).stem}_bicoherence_sparse.csv", index=False)
+        plot_sparse(f, b2, peak, outpng=str(outpng))
+    elif plan["packed"] or plan["memmap"]:
+        outpng = None
+    else:
+        plot_annot(f, b2, peak, f3_est=None, outpng=str(outpng))
 
     plt.figure()
     plt.plot(idxs, L_vals)
@@ -84,11 +163,14 @@ def analyze_file(path, outdir=DEFAULT_OUTDIR, fs_bin=1e6, seglen=131072, B=50,
         "file": str(path),
         "fs_bin": fs_bin,
         "seglen": seglen,
+        "sparse": sparse,
         "f1_peak": peak["f1"],
         "f2_peak": peak["f2"],
         "b2_peak": peak["b2_peak"],
         "peak_z": zscore,
         "peak_p": pval,
+        "sig_method": significance,
+        "n_surrogates": n_used,
         "null_mean": mu,
         "null_sd": sd,
         "f1_est": f1_est,
@@ -96,17 +178,25 @@ def analyze_file(path, outdir=DEFAULT_OUTDIR, fs_bin=1e6, seglen=131072, B=50,
         "L_static": L_static,
         "coh_time_ge_0.5": coh_t,
     }
-    return row, str(outpng), str(png_lock)
+    if significance == "evd":
+        row.update({f"evd_{k}": fit[k] for k in ("loc", "scale", "ks_p", "ppcc", "extrapolation")})
+    return row, outpng and str(outpng), str(png_lock)
 
 
 def main(glob_pattern=DEFAULT_GLOB_PATTERN, out_csv=DEFAULT_SUMMARY,
-         outdir=DEFAULT_OUTDIR, fs_bin=1e6, seglen=131072, B=50):
+         outdir=DEFAULT_OUTDIR, fs_bin=1e6, seglen=131072, B=50, f1_range=None, f2_range=None,
+         sparse=False, significance="surrogate", precision="float64", surrogate_workers=None,
+         surrogate_method="phase", mem_budget=None, on_over="downgrade", memmap=False):
     pattern = str(glob_pattern)
     files = sorted(glob.glob(pattern))
     rows = []
     for fpath in files:
         try:
-            row, p1, p2 = analyze_file(fpath, outdir=outdir, fs_bin=fs_bin, seglen=seglen, B=B)
+            row, p1, p2 = analyze_file(fpath, outdir=outdir, fs_bin=fs_bin, seglen=seglen, B=B,
+                                         f1_range=f1_range, f2_range=f2_range, sparse=sparse,
+                                         significance=significance, precision=precision,
+                                         surrogate_workers=surrogate_workers, surrogate_method=surrogate_method,
+                                         mem_budget=mem_budget, on_over=on_over, memmap=memmap)
             rows.append(row)
             print(
                 "Analyzed:",
@@ -131,4 +221,30 @@ def main(glob_pattern=DEFAULT_GLOB_PATTERN, out_csv=DEFAULT_SUMMARY,
 
 
 if __name__ == "__main__":
-    main()
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[2])
+    ap.add_argument("--glob_pattern", "--glob-pattern", default=str(DEFAULT_GLOB_PATTERN))
+    ap.add_argument("--out_csv", "--out-csv", default=str(DEFAULT_SUMMARY))
+    ap.add_argument("--outdir", default=str(DEFAULT_OUTDIR))
+    ap.add_argument("--fs_bin", "--fs-bin", type=float, default=1e6)
+    ap.add_argument("--seglen", type=int, default=131072)
+    ap.add_argument("--B", type=int, default=50, help="number of surrogates (cap for sequential)")
+    ap.add_argument("--f1-range", type=float, nargs=2, default=None, metavar=("LO", "HI"),
+                    help="restrict f1 to [LO, HI] Hz")
+    ap.add_argument("--f2-range", type=float, nargs=2, default=None, metavar=("LO", "HI"),
+                    help="restrict f2 to [LO, HI] Hz")
+    ap.add_argument("--sparse", action="store_true", help="b2 only around the spectral peaks")
+    ap.add_argument("--significance", choices=("surrogate", "sequential", "evd", "analytic"),
+                    default="surrogate")
+    add_budget_args(ap)
+    add_precision_arg(ap)
+    ap.add_argument("--surrogate-workers", type=int, default=None,
+                    help="processes for the surrogate null (results do not depend on this)")
+    ap.add_argument("--surrogate-method", choices=("phase", "iaaft"), default="phase",
+                    help="iaaft also keeps the amplitude distribution (e.g. Poisson counts)")
+    a = ap.parse_args()
+    main(a.glob_pattern, a.out_csv, a.outdir, fs_bin=a.fs_bin, seglen=a.seglen, B=a.B,
+         f1_range=a.f1_range, f2_range=a.f2_range, sparse=a.sparse,
+         significance=a.significance, precision=a.precision, surrogate_workers=a.surrogate_workers,
+         surrogate_method=a.surrogate_method,
+         mem_budget=None if a.mem_budget is None else int(a.mem_budget * 2**30),
+         on_over=a.on_over_budget, memmap=a.memmap)
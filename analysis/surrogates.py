@@ -1,10 +1,23 @@
 """
 analysis/surrogates.py
-Phase-shuffle surrogates for significance testing of bicoherence peaks.
+Phase-shuffle surrogates for significance testing of bicoherence peaks, plus an
+analytic (chi-square) null that needs no surrogates at all. The *_batch variants
+build B surrogates at once as a (B, N) array (or lazily in chunks) for the
+batched null in bispectrum.batch_max_bicoherence().
 """
 from __future__ import annotations
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import time
 import numpy as np
 import math
+from scipy.integrate import trapezoid
+from scipy.optimize import brentq
+from scipy.stats import beta, chi2, genextreme, gumbel_r, kstest, norm, probplot, t as student_t
+
+# E[m^2]/E[m]^2 for m = |X||Y||Z| with Rayleigh magnitudes: the null mean of
+# b2 under the |X||Y||Z| normalisation is this over the number of segments.
+_RAYLEIGH_RATIO = (4.0/np.pi)**3
 
 def phase_randomize(x: np.ndarray, seed: int=None) -> np.ndarray:
     rng = np.random.default_rng(seed)
@@ -22,6 +35,77 @@ def peak_zscore(peak_val: float, null_vals: list[float]):
     p = 1.0 - 0.5*(1 + math.erf(z/np.sqrt(2)))
     return float(z), float(p), float(mu), float(sd)
 
+def p_value_interval(peak_val: float, null_vals, conf: float = 0.99):
+    """
+    (p_lo, p_hi) bounds on the peak_zscore p-value given that mu and sd are estimated
+    from len(null_vals) surrogates: t interval for the mean, chi-square interval for sd.
+    """
+    null = np.asarray(null_vals, dtype=float)
+    n = len(null)
+    mu = null.mean()
+    sd = null.std(ddof=1) + 1e-12
+    q = 0.5 + conf/2
+    dm = student_t.ppf(q, n - 1)*sd/np.sqrt(n)
+    sd_lo = sd*np.sqrt((n - 1)/chi2.ppf(q, n - 1))
+    sd_hi = sd*np.sqrt((n - 1)/chi2.ppf(1 - q, n - 1))
+    worst, best = peak_val - mu - dm, peak_val - mu + dm
+    z_lo = worst/(sd_hi if worst >= 0 else sd_lo)
+    z_hi = best/(sd_lo if best >= 0 else sd_hi)
+    return float(norm.sf(z_hi)), float(norm.sf(z_lo))
+
+def sequential_peak_test(peak_val: float, null_batches, alpha: float = 0.05, min_B: int = 10,
+                         conf: float = 0.99):
+    """
+    Sequential Monte Carlo version of peak_zscore. null_batches is an iterable (ideally
+    lazy) of arrays of surrogate peak values; batches are consumed until at least min_B
+    values are in and the p-value interval lies entirely below or above alpha, or the
+    iterable is exhausted (the hard cap). Returns (z, p, mu, sd, n_used).
+    """
+    null = []
+    for batch in null_batches:
+        null.extend(np.ravel(batch))
+        if len(null) >= max(min_B, 2):
+            p_lo, p_hi = p_value_interval(peak_val, null, conf)
+            if p_hi < alpha or p_lo > alpha:
+                break
+    return (*peak_zscore(peak_val, null), len(null))
+
+
+_EVD = {"gumbel": gumbel_r, "gev": genextreme}
+
+def evd_peak_test(peak_val: float, null_vals, dist: str = "gumbel"):
+    """
+    Extreme-value version of peak_zscore for few (~10-20) surrogate maxima: fit a Gumbel
+    (dist="gev": generalised extreme value) law to null_vals by maximum likelihood and take
+    p from its upper tail; z is the matching normal quantile, mu/sd the fitted mean/sd.
+    Returns (z, p, mu, sd, diag); diag holds the fit (loc, scale, shape: scipy's c, 0 for
+    Gumbel), a KS test of the null sample against it (ks_stat, ks_p; optimistic as the
+    parameters are fitted), the probability-plot correlation ppcc, n and extrapolation,
+    how many fitted scales the peak lies beyond the largest surrogate. The GEV shape is
+    poorly determined by ~15 values and its tail then tends to understate p; keep the
+    Gumbel default unless B is large.
+    """
+    if dist not in _EVD:
+        raise ValueError(f"Unknown dist: {dist!r} (use 'gumbel' or 'gev').")
+    law = _EVD[dist]
+    null = np.asarray(null_vals, dtype=float)
+    params = law.fit(null)
+    shape, (loc, scale) = (params[0] if dist == "gev" else 0.0), params[-2:]
+    p = float(law.sf(peak_val, *params))
+    mu, var = law.stats(*params, moments="mv")
+    ks = kstest(null, law.cdf, args=params)
+    diag = {
+        "dist": dist,
+        "loc": float(loc),
+        "scale": float(scale),
+        "shape": float(shape),
+        "ks_stat": float(ks.statistic),
+        "ks_p": float(ks.pvalue),
+        "ppcc": float(probplot(null, sparams=params[:-2], dist=law, fit=True)[1][2]),
+        "n": len(null),
+        "extrapolation": float((peak_val - null.max())/scale),
+    }
+    return float(norm.isf(p)), p, float(mu), float(np.sqrt(var)), diag
 
 def time_reverse(x: np.ndarray) -> np.ndarray:
     """Simple time-reversal surrogate."""
@@ -38,3 +122,233 @@ def block_shuffle(x: np.ndarray, block: int = 1024, seed: int = None) -> np.ndar
     blocks = [x[i:i+block] for i in range(0, n, block)]
     rng.shuffle(blocks)
     return np.concatenate(blocks)[:n]
+
+def _batches(draw, B: int, chunk: int = None):
+    """draw(B) at once, or a lazy generator of draw(<= chunk) blocks consuming the RNG in the same order."""
+    if chunk is None:
+        return draw(B)
+    return (draw(min(chunk, B - b)) for b in range(0, B, chunk))
+
+def phase_randomize_batch(x: np.ndarray, B: int, seed: int = None, chunk: int = None):
+    """
+    B phase-randomised surrogates of x as a (B, N) array (or, with chunk, a generator of
+    (<= chunk, N) blocks). The magnitude spectrum is computed once, all phases of a block
+    are drawn together and a single irfft runs along axis 1. Chunked and unchunked calls
+    with the same seed give the same rows.
+    """
+    x = np.asarray(x)
+    n = len(x)
+    mag = np.abs(np.fft.rfft(x))
+    rng = np.random.default_rng(seed)
+    def draw(m):
+        ph = np.exp(1j * rng.uniform(0, 2*np.pi, size=(m, mag.size)))
+        return np.fft.irfft(mag * ph, n=n, axis=1)
+    return _batches(draw, B, chunk)
+
+def block_shuffle_batch(x: np.ndarray, B: int, block: int = 1024, seed: int = None, chunk: int = None):
+    """B block-shuffled surrogates as (B, N) (or chunked like phase_randomize_batch), one gather per block."""
+    x = np.asarray(x)
+    n = len(x)
+    rng = np.random.default_rng(seed)
+    block = max(1, block)
+    starts = np.arange(0, n, block)
+    lens = np.minimum(block, n - starts)
+    def draw(m):
+        P = rng.permuted(np.tile(np.arange(len(starts)), (m, 1)), axis=1)
+        L = lens[P]
+        dst = np.cumsum(L, axis=1) - L
+        src = np.repeat((starts[P] - dst).ravel(), L.ravel()).reshape(m, n) + np.arange(n)
+        return x[src]
+    return _batches(draw, B, chunk)
+
+def time_reverse_batch(x: np.ndarray, B: int, chunk: int = None):
+    """B time-reversed copies as a read-only (B, N) broadcast view (chunked like the others)."""
+    rev = np.asarray(x)[::-1]
+    return _batches(lambda m: np.broadcast_to(rev, (m, len(rev))), B, chunk)
+
+
+def _iaaft(x: np.ndarray, rngs, max_iter: int, tol: float):
+    x = np.asarray(x)
+    n = len(x)
+    xs = np.sort(x)
+    mag = np.abs(np.fft.rfft(x))
+    norm_mag = np.linalg.norm(mag) + 1e-300
+    S = np.stack([rng.permutation(x) for rng in rngs])
+    m = len(S)
+    n_iter = np.zeros(m, dtype=int)
+    err = np.full(m, np.inf)
+    converged = np.zeros(m, dtype=bool)
+    active = np.arange(m)
+    A = S.copy()                               # working copy of the still-active rows
+    for it in range(max_iter):
+        F = np.fft.rfft(A, axis=1)
+        absF = np.abs(F)
+        e = np.linalg.norm(absF - mag, axis=1) / norm_mag
+        # impose the spectrum, then the amplitudes by rank order (all active rows at once)
+        Y = np.fft.irfft(F * (mag / np.maximum(absF, 1e-300)), n=n, axis=1)
+        A_new = np.empty_like(A)
+        np.put_along_axis(A_new, np.argsort(Y, axis=1), xs[None, :], axis=1)
+        n_iter[active] = it + 1
+        done = np.all(A_new == A, axis=1) | (err[active] - e <= tol * e)
+        err[active] = e
+        converged[active] = done
+        S[active[done]] = A_new[done]
+        active, A = active[~done], A_new[~done]
+        if active.size == 0:
+            break
+    S[active] = A                              # rows that hit max_iter
+    return S, {"n_iter": n_iter, "spec_err": err, "converged": converged}
+
+def iaaft_batch(x: np.ndarray, B: int, seed: int = None, max_iter: int = 100, tol: float = 1e-3):
+    """
+    B iterated amplitude-adjusted Fourier-transform surrogates of x: exactly the values
+    of x (rank-order remapping) with approximately its magnitude spectrum. All rows
+    iterate together (one rfft/irfft along axis 1, one batched argsort per pass); a row
+    drops out once a pass leaves it unchanged or improves its relative spectrum error by
+    less than tol. Returns (S, info), S (B, N) and info with per-row n_iter, spec_err
+    (at the last check) and converged, plus the wall time in seconds.
+    """
+    t0 = time.perf_counter()
+    rng = np.random.default_rng(seed)
+    S, info = _iaaft(x, [rng] * B, max_iter, tol)
+    info["seconds"] = time.perf_counter() - t0
+    return S, info
+
+def iaaft_streams(x: np.ndarray, seeds, max_iter: int = 100, tol: float = 1e-3) -> np.ndarray:
+    """iaaft_batch() rows with one SeedSequence per surrogate (see surrogate_seeds)."""
+    return _iaaft(x, [np.random.default_rng(s) for s in seeds], max_iter, tol)[0]
+
+def surrogate_seeds(seed, b0: int, b1: int, n_channels: int = 3):
+    """
+    SeedSequences for surrogates b0..b1-1: entry [c][b - b0] is child b of seed, grandchild c
+    (SeedSequence(seed).spawn(B)[b].spawn(n_channels)[c]), built from its spawn key so any
+    block of surrogates can be seeded without spawning the ones before it.
+    """
+    entropy = np.random.SeedSequence(seed).entropy
+    return [[np.random.SeedSequence(entropy, spawn_key=(b, c)) for b in range(b0, b1)]
+            for c in range(n_channels)]
+
+def phase_randomize_streams(x: np.ndarray, seeds) -> np.ndarray:
+    """One phase-randomised surrogate of x per SeedSequence in seeds, as a (len(seeds), N) array."""
+    x = np.asarray(x)
+    n = len(x)
+    mag = np.abs(np.fft.rfft(x))
+    ph = np.stack([np.random.default_rng(s).uniform(0, 2*np.pi, size=mag.size) for s in seeds])
+    return np.fft.irfft(mag * np.exp(1j * ph), n=n, axis=1)
+
+_STREAMS = {"phase": phase_randomize_streams, "iaaft": iaaft_streams}
+
+def _surrogate_block(evaluate, signals, kwargs, method, seed, b0, b1):
+    seeds = surrogate_seeds(seed, b0, b1, len(signals))
+    surr = [_STREAMS[method](s, ss) for s, ss in zip(signals, seeds)]
+    return np.ravel(evaluate(*surr, **kwargs))
+
+_WORKER = {}
+
+def _init_worker(evaluate, signals, kwargs, method):
+    _WORKER.update(evaluate=evaluate, signals=signals, kwargs=kwargs, method=method)
+
+def _run_block(seed, b0, b1):
+    return _surrogate_block(_WORKER["evaluate"], _WORKER["signals"], _WORKER["kwargs"],
+                            _WORKER["method"], seed, b0, b1)
+
+def run_surrogates(evaluate, signals, B: int, seed=None, chunk: int = 8, workers: int = None,
+                   method: str = "phase", **kwargs):
+    """
+    Lazily yield evaluate(*surrogates, **kwargs) (flattened) for B phase-randomised
+    (method="iaaft": IAAFT) surrogates of each signal, chunk surrogates per call, in surrogate order. Surrogate b of
+    signal c is drawn from its own stream (surrogate_seeds), so the values do not depend on
+    chunk or workers. workers > 1 runs blocks on a process pool (signals are sent once per
+    worker; evaluate must be a module-level function), keeping at most workers blocks in
+    flight so a consumer that stops early (sequential_peak_test) wastes little work.
+    """
+    if method not in _STREAMS:
+        raise ValueError(f"Unknown surrogate method: {method!r} (use 'phase' or 'iaaft').")
+    seed = np.random.SeedSequence(seed).entropy
+    blocks = [(b, min(b + chunk, B)) for b in range(0, B, chunk)]
+    if not workers or workers <= 1:
+        for b0, b1 in blocks:
+            yield _surrogate_block(evaluate, signals, kwargs, method, seed, b0, b1)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(evaluate, signals, kwargs, method)) as pool:
+        todo = iter(blocks)
+        pending = deque(pool.submit(_run_block, seed, *blk) for _, blk in zip(range(workers), todo))
+        try:
+            while pending:
+                res = pending.popleft().result()
+                nxt = next(todo, None)
+                if nxt is not None:
+                    pending.append(pool.submit(_run_block, seed, *nxt))
+                yield res
+        finally:
+            for fut in pending:
+                fut.cancel()
+
+
+def analytic_bins(b2, f, fs: float) -> np.ndarray:
+    """
+    Values of b2 on the bins the analytic null applies to: evaluated (non-zero) bins
+    with f1 > 0, f2 > 0 and f1 + f2 below Nyquist. Bins touching DC or Nyquist carry
+    a real-valued spectral factor and have a heavier null, so they are left out.
+    f is the axis (or ROI pair) from the estimator; for a sum-line profile pass
+    (f1, f3) as returned by sum_frequency_bicoherence. A profile keeps the max over
+    several lines, so test the flattened lines=True grid with per-bin (f1, f3) instead.
+    """
+    if hasattr(b2, "values"):
+        f1, f2 = f if isinstance(f, tuple) else (f, f)
+        vals = b2.values
+        f1 = np.asarray(f1)[b2.i - b2.offset[0]]
+        f2 = np.asarray(f2)[b2.j - b2.offset[1]]
+    else:
+        vals = np.asarray(b2)
+        f1, f2 = f if isinstance(f, tuple) else (f, f)
+        f1, f2 = np.asarray(f1, dtype=float), np.asarray(f2, dtype=float)
+        if vals.ndim == 1:
+            f2 = f2 - f1                      # (f1, f3) sum-line profile
+        else:
+            f1, f2 = f1[:, None], f2[None, :]
+    keep = (vals != 0) & (f1 > 0) & (f2 > 0) & (f1 + f2 < 0.5*fs*(1 - 1e-9))
+    return vals[np.broadcast_to(keep, vals.shape)]
+
+def _log_cdf_max(x, nseg: int, n_bins: int):
+    """log P(max of n_bins independent null b2 <= x); needs K = nseg/c > 1."""
+    K = nseg/_RAYLEIGH_RATIO
+    return n_bins*np.log1p(-beta(1.0, K - 1.0).sf(np.clip(x, 0.0, 1.0)))
+
+def _null_defined(nseg: int) -> bool:
+    # nseg <= 3 leaves K = nseg/c <= ~1.5 (K - 1 <= 0 for nseg <= 2): b2 is ~1 everywhere
+    # and the Beta(1, K-1) null piles its mass at 1, so no p-value is meaningful
+    return nseg > 3
+
+def analytic_threshold(nseg: int, alpha: float = 0.05, n_bins: int = 1) -> float:
+    """
+    b2 level exceeded with probability alpha under the analytic null. With n_bins > 1
+    the level controls the family-wise rate of the maximum over n_bins bins.
+    """
+    if not _null_defined(nseg):
+        raise ValueError(f"nseg={nseg} is too few segments for the analytic null (need nseg > 3).")
+    target = math.log1p(-alpha)
+    with np.errstate(divide="ignore"):           # log CDF is -inf at the bracket start x = 0
+        return float(brentq(lambda x: _log_cdf_max(x, nseg, n_bins) - target, 0.0, 1.0 - 1e-12))
+
+def analytic_peak_test(peak_val: float, nseg: int, n_bins: int):
+    """
+    Max-statistic test of a bicoherence peak without surrogates, returning (z, p, mu, sd)
+    like peak_zscore. Per bin the null is 2K*b2 ~ chi2(2), used in its finite-sample
+    form b2 ~ Beta(1, K-1), with K = nseg/c the effective number of segments for the
+    |X||Y||Z| normalisation (c = (4/pi)^3). p = 1 - P(max of n_bins null b2 <= peak),
+    z is its one-sided normal equivalent, mu/sd are the mean and sd of the null maximum.
+    For nseg <= 3 b2 is trivially ~1 and all four are NaN.
+    """
+    if n_bins < 1:
+        return float("nan"), 1.0, float("nan"), float("nan")
+    if not _null_defined(nseg):
+        return (float("nan"),)*4
+    with np.errstate(divide="ignore"):
+        p = float(-np.expm1(_log_cdf_max(peak_val, nseg, n_bins)))
+        x = np.linspace(0.0, 1.0, 4001)
+        surv = -np.expm1(_log_cdf_max(x, nseg, n_bins))
+    mu = float(trapezoid(surv, x))
+    sd = float(np.sqrt(max(0.0, trapezoid(2.0*x*surv, x) - mu**2)))
+    return float(norm.isf(p)), p, mu, sd
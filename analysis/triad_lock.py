@@ -7,33 +7,47 @@ L(t) = |⟨exp(i(φ1(f1)+φ2(f2)-φ3(f1+f2)))⟩_win|
 - Compute instantaneous phases via Hilbert transform.
 - Slide a window to estimate time-resolved locking and coherence time.
 
-Also provides a static estimate over full recording.
+Also provides a static estimate over full recording. method="fft" takes the
+three analytic signals from plv_pac.analytic_bank (one FFT pair per channel)
+instead of filtfilt + hilbert; multirate=True band-passes at a reduced rate
+(plv_pac.bandpass_multirate) and resamples back.
 """
 from __future__ import annotations
 import numpy as np
 from scipy.signal import butter, filtfilt, hilbert
 
+from analysis.plv_pac import analytic_bank, bandpass_multirate
+
 def _bp(sig, fs, f_lo, f_hi, order=4):
     ny = 0.5*fs
     lo = max(1e-6, f_lo/ny); hi = min(0.999, f_hi/ny)
     b,a = butter(order, [lo,hi], btype="band")
     return filtfilt(b,a,sig)
 
-def triad_phase_lock(sig1, sig2, sig3, fs, f1, f2, bw=1.0):
-    x1 = _bp(sig1, fs, f1-bw/2, f1+bw/2)
-    y2 = _bp(sig2, fs, f2-bw/2, f2+bw/2)
-    z3 = _bp(sig3, fs, (f1+f2)-bw/2, (f1+f2)+bw/2)
-    ph = np.angle(hilbert(x1)) + np.angle(hilbert(y2)) - np.angle(hilbert(z3))
+def triad_phase_lock(sig1, sig2, sig3, fs, f1, f2, bw=1.0, method="filtfilt", multirate=False):
+    bands = [(f1-bw/2, f1+bw/2), (f2-bw/2, f2+bw/2), ((f1+f2)-bw/2, (f1+f2)+bw/2)]
+    if method == "fft":
+        a1, a2, a3 = (analytic_bank(s, fs, [b])[0] for s, b in zip((sig1, sig2, sig3), bands))
+    elif method == "filtfilt" and multirate:
+        # analytic signal taken at the reduced rate; no full-rate Hilbert transform
+        a1, a2, a3 = (bandpass_multirate(s, fs, *b, analytic=True)[0] for s, b in zip((sig1, sig2, sig3), bands))
+    elif method == "filtfilt":
+        a1, a2, a3 = (hilbert(_bp(s, fs, *b)) for s, b in zip((sig1, sig2, sig3), bands))
+    else:
+        raise ValueError(f"Unknown method: {method!r} (use 'filtfilt' or 'fft').")
+    ph = np.angle(a1) + np.angle(a2) - np.angle(a3)
     return float(np.abs(np.exp(1j*ph).mean()))
 
-def triad_phase_lock_sliding(sig1, sig2, sig3, fs, f1, f2, bw=1.0, win_s=1.0, step_s=0.25):
+def triad_phase_lock_sliding(sig1, sig2, sig3, fs, f1, f2, bw=1.0, win_s=1.0, step_s=0.25, method="filtfilt",
+                             multirate=False):
     n = len(sig1)
     win = int(win_s*fs); step = int(step_s*fs)
     vals = []
     idxs = []
     for start in range(0, n-win+1, step):
         end = start + win
-        vals.append(triad_phase_lock(sig1[start:end], sig2[start:end], sig3[start:end], fs, f1, f2, bw=bw))
+        vals.append(triad_phase_lock(sig1[start:end], sig2[start:end], sig3[start:end], fs, f1, f2, bw=bw, method=method,
+                                     multirate=multirate))
         idxs.append((start+end)/2.0/fs)
     return np.array(idxs), np.array(vals)
 
@@ -12,7 +12,7 @@ import pandas as pd
 from model.lagrangian import TrinityModel
 from sim.pde1d import integrate_1d
 from control.closed_loop import GainController
-from analysis.plv_pac import plv, pac_tort
+from sweeps.focused_sweep import metrics_center
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
 OUT_DIR = PROJECT_ROOT / "out"
@@ -28,19 +28,8 @@ def objective(row, w_plv=1.0, w_pac=1.0):
     return w_plv * plv_sum + w_pac * pac_sum
 
 
-def metrics_from_sim(Phi, dt):
-    fs = 1.0 / dt
-    center = Phi[:, Phi.shape[1] // 2, :]
-    low = (0.2, 0.5)
-    mid = (40.0, 45.0)
-    high = (120.0, 140.0)
-    return {
-        "plv_low_12": plv(center[:, 0], center[:, 1], fs, *low),
-        "plv_mid_23": plv(center[:, 1], center[:, 2], fs, *mid),
-        "plv_high_13": plv(center[:, 0], center[:, 2], fs, *high),
-        "pac_low_high_13": pac_tort(center[:, 0], center[:, 2], fs, low, high),
-        "pac_low_mid_12": pac_tort(center[:, 0], center[:, 1], fs, low, mid),
-    }
+def metrics_from_sim(Phi, dt, method="filtfilt", multirate=False):
+    return metrics_center(Phi, dt, method=method, multirate=multirate)
 
 
 def explore_local(seed, steps=(0.01, 0.01, 0.01, 0.01), span=2):
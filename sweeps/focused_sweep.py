@@ -13,69 +13,99 @@ import pandas as pd
 from model.lagrangian import TrinityModel
 from sim.pde1d import integrate_1d
 from control.closed_loop import GainController
-from analysis.plv_pac import plv, pac_tort
+from analysis.plv_pac import plv, pac_tort, analytic_signal, phase_bin, tort_mi
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
 OUT_DIR = PROJECT_ROOT / "out"
 
 OUT = OUT_DIR / "triality_focused_results.csv"
 
+LOW = (0.2, 0.5)
+MID = (40.0, 45.0)
+HIGH = (120.0, 140.0)
+# metric -> (channel a, channel b, band) for PLV, (phase channel, amp channel, phase band, amp band) for PAC
+PLV_METRICS = {"plv_low_12": (0, 1, LOW), "plv_mid_23": (1, 2, MID), "plv_high_13": (0, 2, HIGH)}
+PAC_METRICS = {"pac_low_high_13": (0, 2, LOW, HIGH), "pac_low_mid_12": (0, 1, LOW, MID)}
 
-def metrics_center(Phi, dt) -> Dict[str, float]:
-    """Compute center-point PLV/PAC metrics consistent with prior scripts."""
+
+def metrics_center(Phi, dt, method="filtfilt", multirate=False) -> Dict[str, float]:
+    """
+    Center-point PLV/PAC metrics (PLV_METRICS, PAC_METRICS) consistent with prior
+    scripts; shared by all sweeps. One bandpass+Hilbert per (channel, band) through
+    a shared cache (method="fft": one forward FFT per channel).
+    """
     fs = 1.0 / dt
     center = Phi[:, Phi.shape[1] // 2, :]
-    low = (0.2, 0.5)
-    mid = (40.0, 45.0)
-    high = (120.0, 140.0)
-    return {
-        "plv_low_12": plv(center[:, 0], center[:, 1], fs, *low),
-        "plv_mid_23": plv(center[:, 1], center[:, 2], fs, *mid),
-        "plv_high_13": plv(center[:, 0], center[:, 2], fs, *high),
-        "pac_low_high_13": pac_tort(center[:, 0], center[:, 2], fs, low, high),
-        "pac_low_mid_12": pac_tort(center[:, 0], center[:, 1], fs, low, mid),
-    }
-
-
-def bootstrap_time(Phi, dt, B=30, block=None, seed=42) -> Dict[str, Tuple[float, float, float]]:
+    # the cache is keyed by array identity: keep one view per channel alive
+    chans = [center[:, k] for k in range(3)]
+    kw = dict(cache={}, method=method, multirate=multirate)
+    out = {k: plv(chans[a], chans[b], fs, *band, **kw) for k, (a, b, band) in PLV_METRICS.items()}
+    out.update({k: pac_tort(chans[a], chans[b], fs, pb, ab, **kw) for k, (a, b, pb, ab) in PAC_METRICS.items()})
+    return out
+
+
+def bootstrap_indices(Nt, B, block=None, rng=None):
+    """
+    All B resampled index sets as a (B, Nt) array: i.i.d. draws with replacement,
+    or (block > 1) concatenated contiguous blocks of that length with random starts.
+    """
+    rng = np.random.default_rng(rng)
+    if block is None or block <= 1:
+        return rng.integers(0, Nt, size=(B, Nt))
+    n_blocks = int(np.ceil(Nt / block))
+    starts = rng.integers(0, max(1, Nt - block), size=(B, n_blocks))
+    return (starts[:, :, None] + np.arange(block)).reshape(B, -1)[:, :Nt]
+
+
+def center_components(Phi, dt, method="filtfilt", multirate=False, n_bins=18):
+    """
+    Per-sample ingredients of the metrics_center statistics, filtered once on the
+    full record: for PLV the unit phasor products u_a*conj(u_b), for PAC the phase
+    bin of the phase channel and the envelope of the amplitude channel.
+    """
+    fs = 1.0 / dt
+    center = Phi[:, Phi.shape[1] // 2, :]
+    chans = [center[:, k] for k in range(3)]
+    kw = dict(cache={}, method=method, multirate=multirate)
+    z = lambda c, band: analytic_signal(chans[c], fs, *band, **kw)
+    unit = lambda v: v / np.maximum(np.abs(v), 1e-300)
+    plv_parts = {k: unit(z(a, band)) * np.conj(unit(z(b, band))) for k, (a, b, band) in PLV_METRICS.items()}
+    pac_parts = {k: (phase_bin(np.angle(z(a, pb)), n_bins), np.abs(z(b, ab)))
+                 for k, (a, b, pb, ab) in PAC_METRICS.items()}
+    return plv_parts, pac_parts
+
+
+def replicate_metrics(plv_parts, pac_parts, idx, n_bins=18) -> Dict[str, np.ndarray]:
+    """Each center metric for every row of idx (B, Nt) at once, as metric -> (B,) array."""
+    B = idx.shape[0]
+    out = {k: np.abs(d[idx].mean(axis=1)) for k, d in plv_parts.items()}
+    # per replicate mean envelope per phase bin: one weighted bincount over all rows
+    offset = (n_bins * np.arange(B))[:, None]
+    for k, (bins, amp) in pac_parts.items():
+        keys = (bins[idx] + offset).ravel()
+        sums = np.bincount(keys, weights=amp[idx].ravel(), minlength=B * n_bins).reshape(B, n_bins)
+        counts = np.bincount(keys, minlength=B * n_bins).reshape(B, n_bins)
+        out[k] = tort_mi(np.divide(sums, counts, out=np.zeros_like(sums), where=counts > 0), n_bins)
+    return out
+
+
+def bootstrap_time(Phi, dt, B=30, block=None, seed=42, method="filtfilt", multirate=False,
+                   n_bins=18) -> Dict[str, Tuple[float, float, float]]:
     """
     Bootstrap CIs for metrics by resampling time indices with replacement.
     If block is provided (int), sample contiguous blocks of that length.
+    Phases and envelopes are computed once on the full record (center_components);
+    the B index sets are drawn together (bootstrap_indices) and every replicate's
+    PLV/PAC comes from vectorized reductions over them (replicate_metrics).
     Returns dict of metric -> (mean, lo95, hi95)
     """
     rng = np.random.default_rng(seed)
-    Nt = Phi.shape[0]
-    idx_all = np.arange(Nt)
-
-    def sample_indices():
-        if block is None or block <= 1:
-            return rng.choice(idx_all, size=Nt, replace=True)
-        blocks = []
-        n_blocks = int(np.ceil(Nt / block))
-        for _ in range(n_blocks):
-            start = rng.integers(0, max(1, Nt - block))
-            blocks.append(np.arange(start, start + block))
-        idx = np.concatenate(blocks)[:Nt]
-        return idx
-
-    metrics = {
-        "plv_low_12": [],
-        "plv_mid_23": [],
-        "plv_high_13": [],
-        "pac_low_high_13": [],
-        "pac_low_mid_12": [],
-    }
-
-    for _ in range(B):
-        idx = sample_indices()
-        Phi_b = Phi[idx]
-        m = metrics_center(Phi_b, dt)
-        for k, v in m.items():
-            metrics[k].append(v)
+    plv_parts, pac_parts = center_components(Phi, dt, method=method, multirate=multirate, n_bins=n_bins)
+    idx = bootstrap_indices(Phi.shape[0], B, block, rng)
+    metrics = replicate_metrics(plv_parts, pac_parts, idx, n_bins=n_bins)
 
     out = {}
     for k, vals in metrics.items():
-        vals = np.array(vals, dtype=float)
         mean = float(vals.mean())
         lo = float(np.quantile(vals, 0.025))
         hi = float(np.quantile(vals, 0.975))
@@ -11,14 +11,14 @@ import pandas as pd
 from model.lagrangian import TrinityModel
 from sim.pde1d import integrate_1d
 from control.closed_loop import GainController
-from analysis.plv_pac import plv, pac_tort
+from sweeps.focused_sweep import metrics_center
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
 OUT_DIR = PROJECT_ROOT / "out"
 OUT = OUT_DIR / "triality_sweep_results.csv"
 
 
-def summary_metrics(Phi, fs):
+def summary_metrics(Phi, fs, method="filtfilt", multirate=False):
     """
     Compute metrics:
       - per-field RMS
@@ -31,18 +31,6 @@ def summary_metrics(Phi, fs):
     flat = Phi.reshape(Phi.shape[0] * Phi.shape[1], 3)
     corr = np.corrcoef(flat, rowvar=False)
 
-    center = Phi[:, Phi.shape[1] // 2, :]
-    low = (0.2, 0.5)
-    mid = (40.0, 45.0)
-    high = (120.0, 140.0)
-
-    plv_l_12 = plv(center[:, 0], center[:, 1], fs, *low)
-    plv_m_23 = plv(center[:, 1], center[:, 2], fs, *mid)
-    plv_h_13 = plv(center[:, 0], center[:, 2], fs, *high)
-
-    pac_lh_13 = pac_tort(center[:, 0], center[:, 2], fs, low, high)
-    pac_lm_12 = pac_tort(center[:, 0], center[:, 1], fs, low, mid)
-
     return {
         "rms1": float(rms[0]),
         "rms2": float(rms[1]),
@@ -50,11 +38,7 @@ def summary_metrics(Phi, fs):
         "corr12": float(corr[0, 1]),
         "corr13": float(corr[0, 2]),
         "corr23": float(corr[1, 2]),
-        "plv_low_12": float(plv_l_12),
-        "plv_mid_23": float(plv_m_23),
-        "plv_high_13": float(plv_h_13),
-        "pac_low_high_13": float(pac_lh_13),
-        "pac_low_mid_12": float(pac_lm_12),
+        **metrics_center(Phi, 1.0 / fs, method=method, multirate=multirate),
     }
 
 
@@ -0,0 +1,266 @@
+"""
+Tests for the bispectrum / bicoherence estimators
+"""
+import pytest
+import numpy as np
+import sys
+import os
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from analysis.bispectrum import bispectrum, cross_bispectrum
+
+
+def _segments(x, seglen):
+    """Half-overlapping segments by explicit slicing, independent of the engine's _segment."""
+    step = seglen//2
+    return np.array([x[s:s + seglen] for s in range(0, len(x) - seglen + 1, step)])
+
+
+def _reference(a_sig, b_sig, c_sig, seglen):
+    """Direct triple-loop estimator the vectorized engine must reproduce."""
+    win = np.hanning(seglen)[None, :]
+    FA = np.fft.rfft(_segments(a_sig, seglen) * win, axis=1)
+    FB = np.fft.rfft(_segments(b_sig, seglen) * win, axis=1)
+    FC = np.fft.rfft(_segments(c_sig, seglen) * win, axis=1)
+    nF = FA.shape[1]
+    S3 = np.zeros((nF, nF), dtype=complex)
+    S2 = np.zeros((nF, nF), dtype=float)
+    for a, b, c in zip(FA, FB, FC):
+        for i in range(nF):
+            for j in range(nF - i):
+                S3[i, j] += a[i] * b[j] * np.conj(c[i + j])
+                S2[i, j] += np.abs(a[i]) * np.abs(b[j]) * np.abs(c[i + j])
+    S3 /= FA.shape[0]
+    S2 /= FA.shape[0] + 1e-12
+    return S3, np.abs(S3)**2 / (S2**2 + 1e-20)
+
+
+@pytest.fixture
+def triad():
+    rng = np.random.default_rng(3)
+    return rng.standard_normal((3, 600))
+
+
+def test_bispectrum_matches_reference(triad):
+    """Vectorized auto-bispectrum equals the direct loop"""
+    x = triad[0] - triad[0].mean()
+    S3_ref, b2_ref = _reference(x, x, x, 32)
+    f, S3, b2 = bispectrum(triad[0], fs=100.0, seglen=32)
+    assert f.shape == (17,)
+    np.testing.assert_allclose(S3, S3_ref, rtol=1e-10, atol=1e-12)
+    np.testing.assert_allclose(b2, b2_ref, rtol=1e-10, atol=1e-12)
+
+
+def test_cross_bispectrum_matches_reference(triad):
+    """Vectorized cross-bispectrum equals the direct loop"""
+    x, y, z = (s - s.mean() for s in triad)
+    S3_ref, b2_ref = _reference(x, y, z, 32)
+    f, S3, b2 = cross_bispectrum(*triad, fs=100.0, seglen=32)
+    np.testing.assert_allclose(S3, S3_ref, rtol=1e-10, atol=1e-12)
+    np.testing.assert_allclose(b2, b2_ref, rtol=1e-10, atol=1e-12)
+
+
+def test_roi_matches_full_plane_slice(triad):
+    """An f1/f2 range computes exactly the corresponding block of the full plane"""
+    f, S3, b2 = cross_bispectrum(*triad, fs=100.0, seglen=64)
+    (f1, f2), S3r, b2r = cross_bispectrum(*triad, fs=100.0, seglen=64,
+                                          f1_range=(10.0, 20.0), f2_range=(5.0, 30.0))
+    rows = (f >= 10.0) & (f <= 20.0)
+    cols = (f >= 5.0) & (f <= 30.0)
+    np.testing.assert_array_equal(f1, f[rows])
+    np.testing.assert_array_equal(f2, f[cols])
+    np.testing.assert_allclose(b2r, b2[np.ix_(rows, cols)], rtol=1e-12)
+
+
+def test_packed_expands_to_dense(triad):
+    """Principal-domain storage expands to the dense plane and keeps the peak"""
+    from analysis.bispec_peaks import find_bicoherence_peak
+    f, S3, b2 = bispectrum(triad[0], fs=100.0, seglen=64)
+    _, S3p, b2p = bispectrum(triad[0], fs=100.0, seglen=64, packed=True)
+    assert len(b2p) < b2.size // 3
+    np.testing.assert_allclose(np.asarray(S3p), S3, rtol=1e-12)
+    np.testing.assert_allclose(b2p.toarray(), b2, rtol=1e-12)
+    assert find_bicoherence_peak(b2p, f) == find_bicoherence_peak(b2, f)
+
+    _, _, b2x = cross_bispectrum(*triad, fs=100.0, seglen=64)
+    _, _, b2xp = cross_bispectrum(*triad, fs=100.0, seglen=64, packed=True)
+    np.testing.assert_allclose(np.asarray(b2xp), b2x, rtol=1e-12)
+
+
+def test_accumulator_chunks_and_merge(triad):
+    """Chunked feeding and merging reproduce the in-memory estimator"""
+    from analysis.bispectrum import BispectrumAccumulator
+    x, y, z = (s - s.mean() for s in triad)
+    _, S3, b2 = cross_bispectrum(*triad, fs=100.0, seglen=32)
+
+    acc = BispectrumAccumulator(100.0, 32, channels=3)
+    for lo, hi in [(0, 7), (7, 100), (100, 101), (101, 600)]:
+        acc.update(x[lo:hi], y[lo:hi], z[lo:hi])
+    np.testing.assert_allclose(acc.result()[2], b2, rtol=1e-10)
+
+    # split at a segment boundary: the second half starts where segment 20 starts
+    a = BispectrumAccumulator(100.0, 32, channels=3).update(x[:336], y[:336], z[:336])
+    b = BispectrumAccumulator(100.0, 32, channels=3).update(x[320:], y[320:], z[320:])
+    merged = a.merge(b)
+    assert merged.nseg == acc.nseg
+    np.testing.assert_allclose(merged.result()[1], S3, rtol=1e-10)
+
+
+def test_accumulator_chunks_with_gaps(triad):
+    """step > seglen: samples between segments are skipped across chunk boundaries"""
+    from analysis.bispectrum import BispectrumAccumulator
+    x, y, z = (s - s.mean() for s in triad)
+    _, _, b2 = cross_bispectrum(x, y, z, fs=100.0, seglen=32, step=48)
+    acc = BispectrumAccumulator(100.0, 32, step=48, channels=3)
+    for lo in range(0, 600, 33):
+        acc.update(x[lo:lo + 33], y[lo:lo + 33], z[lo:lo + 33])
+    assert acc.nseg == 1 + (600 - 32)//48
+    np.testing.assert_allclose(acc.result()[2], b2, rtol=1e-10)
+
+def test_segment_spectra_shared(triad):
+    """Precomputed SegmentSpectra give the same result as raw samples"""
+    from analysis.bispectrum import SegmentSpectra
+    from analysis.bispec_peaks import dominant_freq
+    specs = [SegmentSpectra(s, 100.0, 32) for s in triad]
+    np.testing.assert_allclose(bispectrum(specs[0])[2], bispectrum(triad[0], 100.0, 32)[2])
+    np.testing.assert_allclose(cross_bispectrum(*specs)[2], cross_bispectrum(*triad, 100.0, 32)[2])
+    assert dominant_freq(specs[0], nmax=2)[0].shape == (2,)
+    with pytest.raises(ValueError):
+        bispectrum(specs[0], seglen=64)
+
+
+def test_workers_bit_identical(triad, monkeypatch):
+    """Threaded tiles reproduce the serial result exactly"""
+    import analysis.bispectrum as bs
+    monkeypatch.setattr(bs, "_TILE_ELEMS", 64)
+    _, S3, b2 = cross_bispectrum(*triad, fs=100.0, seglen=64)
+    _, S3w, b2w = cross_bispectrum(*triad, fs=100.0, seglen=64, workers=4)
+    assert np.array_equal(S3, S3w) and np.array_equal(b2, b2w)
+
+
+def test_sum_frequency_slice_matches_plane(triad):
+    """The sum-line profile equals the anti-diagonal of the full plane"""
+    from analysis.bispectrum import sum_frequency_bicoherence
+    f, _, b2 = cross_bispectrum(*triad, fs=100.0, seglen=64)
+    f1, f3, prof = sum_frequency_bicoherence(*triad, f3=25.0, fs=100.0, seglen=64)
+    k = 16  # 25 Hz at 1.5625 Hz bins
+    np.testing.assert_allclose(f3, f[k])
+    np.testing.assert_allclose(prof, [b2[i, k - i] for i in range(k + 1)], rtol=1e-10)
+
+
+def test_all_triads_share_spectra(triad):
+    """Every ordered triad matches a direct cross-bispectrum call"""
+    from analysis.triad_bispec import triad_bicoherence
+    X = triad.T
+    f, labels, stack = triad_bicoherence(X, 100.0, 32, names=["a", "b", "c"])
+    assert len(labels) == 6 and stack.shape[0] == 6
+    for (la, lb, lc), b2 in zip(labels, stack):
+        a, b, c = ("abc".index(n) for n in (la, lb, lc))
+        np.testing.assert_allclose(b2, cross_bispectrum(X[:, a], X[:, b], X[:, c], 100.0, 32)[2], rtol=1e-10)
+
+
+def test_peak_guided_pairs_match_plane():
+    """Sparse candidates carry the dense b2 values and find the triad peak"""
+    from analysis.bispectrum import peak_guided_bicoherence
+    from analysis.bispec_peaks import find_bicoherence_peak
+    from analysis.synth_triad import make_triad
+    _, X = make_triad(T=4.096)
+    f, _, b2 = cross_bispectrum(*X.T, fs=1000.0, seglen=512)
+    fp, _, b2p = peak_guided_bicoherence(*X.T, fs=1000.0, seglen=512, top_k=2, radius=1)
+    assert len(b2p) < 100
+    np.testing.assert_allclose(b2p.values, b2[b2p.i, b2p.j], rtol=1e-10)
+    assert find_bicoherence_peak(b2p, fp) == find_bicoherence_peak(b2, f)
+
+
+def test_sliding_window_matches_batch(triad):
+    """Each ring-buffered window equals a fresh estimate over its segments"""
+    from analysis.bispectrum import sliding_bicoherence, BispectrumAccumulator
+    roi = dict(f1_range=(5.0, 20.0), f2_range=(0.0, 10.0))
+    t, f, b2_t = sliding_bicoherence(*triad, fs=100.0, seglen=32, win_segs=6, hop_segs=2, **roi)
+    x, y, z = (s - s.mean() for s in triad)
+    for w in (0, 5, len(t) - 1):
+        lo = 2 * w * 16
+        hi = lo + 5 * 16 + 32
+        acc = BispectrumAccumulator(100.0, 32, channels=3, **roi).update(x[lo:hi], y[lo:hi], z[lo:hi])
+        np.testing.assert_allclose(b2_t[w], acc.result()[2], rtol=1e-8)
+        assert t[w] == pytest.approx((lo + hi) / 2 / 100.0)
+
+
+def test_direct_method(triad):
+    """Direct estimator: no smoothing reduces to one full-length segment; ROI is a sub-block"""
+    x = triad[0][:512]
+    _, S3, _ = bispectrum(x, fs=100.0, seglen=512)
+    _, S3d, _ = bispectrum(x, fs=100.0, seglen=512, method="direct")
+    np.testing.assert_allclose(S3d, S3, rtol=1e-9, atol=1e-12)
+
+    f, _, b2 = cross_bispectrum(*triad, fs=100.0, seglen=64, method="direct", kernel="hann")
+    (f1, f2), _, b2r = cross_bispectrum(*triad, fs=100.0, seglen=64, method="direct", kernel="hann",
+                                        f1_range=(10.0, 20.0), f2_range=(0.0, 15.0))
+    assert b2.shape == (33, 33) and b2.max() <= 1.0
+    np.testing.assert_allclose(b2r, b2[np.ix_((f >= 10.0) & (f <= 20.0), f <= 15.0)], rtol=1e-8, atol=1e-12)
+
+
+def test_memmap_output_matches_in_memory(triad, tmp_path):
+    """Memmapped S3/b2 hold the same values as the in-memory planes"""
+    _, S3, b2 = cross_bispectrum(*triad, fs=100.0, seglen=64)
+    _, S3m, b2m = cross_bispectrum(*triad, fs=100.0, seglen=64, memmap=str(tmp_path / "x"))
+    assert isinstance(b2m, np.memmap)
+    np.testing.assert_array_equal(np.load(tmp_path / "x_b2.npy"), b2)
+    np.testing.assert_array_equal(np.load(tmp_path / "x_S3.npy"), S3)
+
+
+def test_preflight_downgrades_or_refuses():
+    """Over budget the planner falls back to memmap/ROI, or refuses"""
+    from analysis.bispec_plan import plan_bispectrum, preflight
+    full = plan_bispectrum(10**6, 8192, fs=1e4)
+    assert full["bins"] == 4097**2 and full["nseg"] == 1 + (10**6 - 8192) // 4096
+    budget = full["ram_bytes"] // 2
+    plan = preflight(10**6, 8192, budget=budget, fs=1e4)
+    assert plan["ram_bytes"] <= budget and plan["memmap"]
+    small = preflight(10**6, 8192, budget=full["ram_bytes"] // 3, fs=1e4)
+    assert small["f1_range"] is not None and small["bins"] < full["bins"]
+    with pytest.raises(MemoryError):
+        preflight(10**6, 8192, budget=budget, on_over="refuse", fs=1e4)
+
+
+
+def test_preflight_batch_shrinks_chunk_first():
+    """Surrogate chunks count toward the plan and are halved before the plane is downgraded"""
+    from analysis.bispec_plan import plan_bispectrum, preflight_batch
+    plane = plan_bispectrum(10**6, 4096, fs=1e4)
+    full = plan_bispectrum(10**6, 4096, fs=1e4, batch=16)
+    assert full["ram_bytes"] > plane["ram_bytes"]
+    budget = plan_bispectrum(10**6, 4096, fs=1e4, batch=4)["ram_bytes"]
+    plan, chunk = preflight_batch(10**6, 4096, 16, budget=budget, fs=1e4)
+    assert chunk == 4 and not plan["packed"] and not plan["memmap"]
+    with pytest.raises(MemoryError):
+        preflight_batch(10**6, 4096, 16, budget=budget, on_over="refuse", fs=1e4)
+    line = plan_bispectrum(10**6, 4096, fs=1e4, lines=5, packed=True)
+    assert line["bins"] == 5 * 2049 and not line["packed"]
+
+def test_available_memory_prefers_memavailable(monkeypatch):
+    """The budget reads MemAvailable (page cache included), not MemFree"""
+    import builtins, io
+    from analysis import bispec_plan
+    meminfo = "MemTotal: 8000000 kB\nMemFree: 1000 kB\nMemAvailable: 6000000 kB\n"
+    real_open = builtins.open
+    monkeypatch.setattr(builtins, "open",
+                        lambda f, *a, **k: io.StringIO(meminfo) if f == "/proc/meminfo" else real_open(f, *a, **k))
+    assert bispec_plan.available_memory() == 6000000 * 1024
+
+@pytest.mark.parametrize("path", ["data/jpc/jpc_run_15.csv", "data/synthetic/triad_data.csv"])
+def test_float32_matches_float64(path):
+    """Single precision keeps the peak bin and b2 to ~1e-5 on the bundled data"""
+    from analysis.load_timeseries import load_timeseries
+    from analysis.bispec_peaks import find_bicoherence_peak
+    t, X, _ = load_timeseries(os.path.join(os.path.dirname(__file__), '..', path))
+    fs = 1.0 / np.median(np.diff(t))
+    f, S3, b2 = cross_bispectrum(*X.T, fs=fs, seglen=512)
+    _, S3s, b2s = cross_bispectrum(*X.T.astype(np.float32), fs=fs, seglen=512, precision="float32")
+    assert S3s.dtype == np.complex64 and b2s.dtype == np.float32
+    np.testing.assert_allclose(b2s, b2, atol=1e-5)
+    np.testing.assert_allclose(S3s, S3, atol=1e-5 * np.abs(S3).max())
+    p, ps = find_bicoherence_peak(b2, f), find_bicoherence_peak(b2s, f)
+    assert (p["i"], p["j"]) == (ps["i"], ps["j"])
@@ -0,0 +1,168 @@
+"""
+Tests for the PLV/PAC helpers
+"""
+import pytest
+import numpy as np
+import sys
+import os
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from analysis import plv_pac
+from analysis.plv_pac import bandpass, bandpass_sos, plv, pac_tort
+
+
+def _fields(fs=2000.0, T=8.0, seed=0):
+    t = np.arange(int(T*fs))/fs
+    rng = np.random.default_rng(seed)
+    slow = np.sin(2*np.pi*0.3*t)
+    c1 = slow + 0.1*rng.standard_normal(t.size)
+    c2 = np.sin(2*np.pi*42.0*t + 0.5) + 0.1*rng.standard_normal(t.size)
+    c3 = (1 + 0.5*slow)*np.sin(2*np.pi*130.0*t) + np.sin(2*np.pi*42.0*t) + 0.1*rng.standard_normal(t.size)
+    return fs, np.column_stack([c1, c2, c3])
+
+
+def test_sos_low_band_is_stable():
+    """0.2-0.5 Hz at fs=2000 passes a 0.3 Hz tone (the (b, a) form overflows); the design is cached"""
+    fs = 2000.0
+    y = bandpass(np.sin(2*np.pi*0.3*np.arange(int(40*fs))/fs), fs, 0.2, 0.5)
+    mid = slice(len(y)//4, 3*len(y)//4)
+    assert np.all(np.isfinite(y))
+    assert np.std(y[mid]) == pytest.approx(np.sqrt(0.5), rel=0.02)
+    assert bandpass_sos(fs, 0.2, 0.5, 4) is bandpass_sos(fs, 0.2, 0.5, 4)
+
+
+def test_plv_is_mean_phasor_magnitude():
+    """Shared 42 Hz components lock; independent noise does not (|mean|, not mean |.|)"""
+    fs, X = _fields()
+    assert plv(X[:, 1], X[:, 2], fs, 40.0, 45.0) > 0.9
+    rng = np.random.default_rng(1)
+    assert plv(rng.standard_normal(len(X)), rng.standard_normal(len(X)), fs, 40.0, 45.0) < 0.3
+
+def test_shared_cache_filters_each_band_once(monkeypatch):
+    """The five center metrics run one bandpass+Hilbert per (channel, band): 6 instead of 10"""
+    from sweeps.focused_sweep import metrics_center
+    fs, X = _fields()
+    Phi = X[:, None, :]
+    calls = []
+    real = plv_pac.hilbert
+    monkeypatch.setattr(plv_pac, "hilbert", lambda *a, **k: calls.append(1) or real(*a, **k))
+    m = metrics_center(Phi, 1.0/fs)
+    assert len(calls) == 6
+    low, mid, high = (0.2, 0.5), (40.0, 45.0), (120.0, 140.0)
+    c = [X[:, k] for k in range(3)]
+    assert m["plv_mid_23"] == pytest.approx(plv(c[1], c[2], fs, *mid))
+    assert m["pac_low_high_13"] == pytest.approx(pac_tort(c[0], c[2], fs, low, high))
+    assert m["pac_low_high_13"] > m["pac_low_mid_12"]
+
+
+def test_fft_bank_matches_filtfilt(monkeypatch):
+    """method="fft": one forward FFT per channel, analytic phases as from filtfilt+hilbert"""
+    from analysis.plv_pac import analytic_bank, analytic_signal
+    from sweeps.focused_sweep import metrics_center
+    fs, X = _fields()
+    a, = analytic_bank(X[:, 1], fs, [(40.0, 45.0)])
+    b = analytic_signal(X[:, 1], fs, 40.0, 45.0)
+    mid = slice(len(a)//4, 3*len(a)//4)
+    assert np.abs(np.angle(a[mid]*np.conj(b[mid]))).max() < 0.1
+    assert np.abs(a[mid]).mean() == pytest.approx(np.abs(b[mid]).mean(), rel=0.02)
+    calls = []
+    real = plv_pac.rfft
+    monkeypatch.setattr(plv_pac, "rfft", lambda *a, **k: calls.append(1) or real(*a, **k))
+    m = metrics_center(X[:, None, :], 1.0/fs, method="fft")
+    assert len(calls) == 3
+    ref = metrics_center(X[:, None, :], 1.0/fs)
+    assert m["pac_low_high_13"] == pytest.approx(ref["pac_low_high_13"], rel=0.1)
+
+
+def test_triad_lock_fft():
+    """A phase-locked triad gives L ~ 1 with either method"""
+    from analysis.triad_lock import triad_phase_lock
+    fs = 2000.0
+    t = np.arange(int(10*fs))/fs
+    noise = 0.5*np.random.default_rng(0).standard_normal(t.size)
+    x, y, z = np.sin(2*np.pi*42*t), np.sin(2*np.pi*88*t + 1), np.sin(2*np.pi*130*t + 1.3) + noise
+    for method in ("filtfilt", "fft"):
+        assert triad_phase_lock(x, y, z, fs, 42.0, 88.0, bw=2.0, method=method) > 0.95
+    with pytest.raises(ValueError):
+        triad_phase_lock(x, y, z, fs, 42.0, 88.0, method="wavelet")
+
+
+def test_comodulogram_matches_pac_tort():
+    """Every grid entry equals pac_tort; the 0.3 Hz x 130 Hz coupling wins"""
+    from analysis.plv_pac import comodulogram, band_grid
+    fs, X = _fields()
+    phase_bands = [(0.2, 0.5)] + band_grid(2.0, 10.0, 3, 2.0)
+    amp_bands = band_grid(40.0, 130.0, 4, 20.0)
+    mi = comodulogram(X[:, 0], X[:, 2], fs, phase_bands, amp_bands)
+    assert mi.shape == (4, 4)
+    ref = [[pac_tort(X[:, 0], X[:, 2], fs, p, a) for a in amp_bands] for p in phase_bands]
+    np.testing.assert_allclose(mi, ref, rtol=1e-10, atol=1e-15)
+    assert np.unravel_index(np.argmax(mi), mi.shape) == (0, 3)
+
+
+def test_multirate_low_band():
+    """The 0.2-0.5 Hz band runs at 4 Hz (q=500) and returns a full-rate analytic signal"""
+    from analysis.plv_pac import analytic_signal, bandpass_multirate, decimation_plan
+    fs = 2000.0
+    t = np.arange(int(40*fs))/fs
+    x = np.sin(2*np.pi*0.3*t) + np.sin(2*np.pi*42*t)
+    assert decimation_plan(fs, 0.5, len(x)) == {"q": 500, "stages": [10, 10, 5], "fs": 4.0}
+    assert decimation_plan(fs, 0.5, 1200)["q"] == 10           # short records keep >= 64 samples
+    assert decimation_plan(fs, 140.0, len(x))["q"] == 1
+    z = analytic_signal(x, fs, 0.2, 0.5, multirate=True)
+    mid = slice(len(t)//4, 3*len(t)//4)
+    assert z.shape == x.shape
+    assert np.abs(np.angle(z[mid]*np.exp(-1j*(2*np.pi*0.3*t[mid] - np.pi/2)))).max() < 0.05
+    low, plan = bandpass_multirate(x, fs, 0.2, 0.5, interp=False)
+    assert plan["q"] == 500 and len(low) == 160
+
+
+def test_triad_lock_multirate(monkeypatch):
+    """multirate=True gives the same lock for a phase-locked triad, without a full-rate Hilbert"""
+    from analysis import triad_lock
+    fs = 2000.0
+    t = np.arange(int(10*fs))/fs
+    x, y, z = np.sin(2*np.pi*2*t), np.sin(2*np.pi*3*t + 1), np.sin(2*np.pi*5*t + 1.3)
+    calls = []
+    real = triad_lock.hilbert
+    monkeypatch.setattr(triad_lock, "hilbert", lambda *a, **k: calls.append(1) or real(*a, **k))
+    assert triad_lock.triad_phase_lock(x, y, z, fs, 2.0, 3.0, bw=1.0, multirate=True) > 0.95
+    assert not calls
+
+
+def test_plv_batch_matches_pairwise():
+    """One call over pairs, bands and stacked simulations equals pairwise plv"""
+    from analysis.plv_pac import plv_batch
+    fs, X = _fields(T=4.0)
+    rng = np.random.default_rng(3)
+    S = np.stack([X + 0.5*rng.standard_normal(X.shape) for _ in range(3)], axis=2)
+    bands, pairs = [(40.0, 45.0), (120.0, 140.0)], [(0, 1), (1, 2), (0, 2)]
+    P = plv_batch(S, fs, bands, pairs)
+    assert P.shape == (2, 3, 3)
+    ref = [[[plv(S[:, a, b], S[:, c, b], fs, *band) for b in range(3)] for a, c in pairs] for band in bands]
+    np.testing.assert_allclose(P, ref, rtol=1e-10)
+    assert plv_batch(X, fs, bands, pairs).shape == (2, 3)
+    # 42 Hz is shared by channels 2 and 3 only; noise-only pairs are far from locked
+    assert P[0, 1].min() > 0.9 and P[0, 0].max() < 0.7
+
+
+def test_fast_bootstrap():
+    """Identity resampling reproduces metrics_center; i.i.d. and block CIs bracket the means"""
+    from sweeps.focused_sweep import (metrics_center, center_components, replicate_metrics,
+                                      bootstrap_time, bootstrap_indices)
+    fs, X = _fields(T=4.0)
+    Phi = X[:, None, :]
+    parts = center_components(Phi, 1.0/fs)
+    same = replicate_metrics(*parts, np.arange(len(X))[None])
+    ref = metrics_center(Phi, 1.0/fs)
+    assert set(same) == set(ref)
+    for k in ref:
+        assert same[k][0] == pytest.approx(ref[k], rel=1e-12)
+    idx = bootstrap_indices(1000, 5, block=64, rng=1)
+    assert idx.shape == (5, 1000) and idx.max() < 1000
+    assert np.all(np.diff(idx[:, :64], axis=1) == 1)
+    for block in (None, 200):
+        cis = bootstrap_time(Phi, 1.0/fs, B=20, block=block)
+        assert all(lo <= mean <= hi for mean, lo, hi in cis.values())
@@ -0,0 +1,152 @@
+"""
+Tests for the surrogate and analytic significance helpers
+"""
+import pytest
+import numpy as np
+import sys
+import os
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from analysis.bispectrum import cross_bispectrum
+from analysis.surrogates import analytic_bins, analytic_peak_test, analytic_threshold
+
+
+@pytest.mark.filterwarnings("error::RuntimeWarning")
+def test_analytic_null_calibration():
+    """Noise peaks are not significant; the threshold matches the reported p-value"""
+    rng = np.random.default_rng(11)
+    f, _, b2 = cross_bispectrum(*rng.standard_normal((3, 8192)), fs=1000.0, seglen=128)
+    nseg = 1 + (8192 - 128) // 64
+    vals = analytic_bins(b2, f, 1000.0)
+    # interior only: no DC row/column, nothing on or beyond the Nyquist diagonal
+    assert vals.size == 63 * 62 // 2
+    z, p, mu, sd = analytic_peak_test(vals.max(), nseg, vals.size)
+    assert p > 0.01 and mu > np.mean(vals) and sd > 0
+    thr = analytic_threshold(nseg, 0.05, vals.size)
+    assert analytic_peak_test(thr, nseg, vals.size)[1] == pytest.approx(0.05, rel=1e-6)
+
+
+def test_analytic_detects_triad():
+    """A phase-coupled synthetic triad is highly significant"""
+    from analysis.synth_triad import make_triad
+    _, X = make_triad(T=8.192)
+    f, _, b2 = cross_bispectrum(*X.T, fs=1000.0, seglen=512)
+    vals = analytic_bins(b2, f, 1000.0)
+    z, p, _, _ = analytic_peak_test(vals.max(), 31, vals.size)
+    assert p < 1e-6 and z > 5
+
+
+def test_batched_surrogates():
+    """Batched generators keep the spectrum/blocks and chunking does not change the rows"""
+    from analysis.surrogates import phase_randomize_batch, block_shuffle_batch, time_reverse_batch
+    x = np.random.default_rng(2).standard_normal(1000)
+    S = phase_randomize_batch(x, 5, seed=4)
+    assert S.shape == (5, 1000)
+    np.testing.assert_allclose(np.abs(np.fft.rfft(S, axis=1))[:, 1:-1],
+                               np.broadcast_to(np.abs(np.fft.rfft(x))[1:-1], (5, 499)), rtol=1e-8)
+    np.testing.assert_array_equal(np.vstack(list(phase_randomize_batch(x, 5, seed=4, chunk=2))), S)
+    ramp = np.arange(1000.0)
+    for row in block_shuffle_batch(ramp, 4, block=64, seed=1):
+        p = 0
+        while p < 1000:               # every block start is followed by its intact block
+            L = min(64, 1000 - int(row[p]))
+            assert row[p] % 64 == 0
+            np.testing.assert_array_equal(row[p:p + L], ramp[int(row[p]):int(row[p]) + L])
+            p += L
+    assert time_reverse_batch(x, 3)[2, 0] == x[-1]
+
+
+def test_batch_max_matches_loop():
+    """One batched null job equals B separate cross_bispectrum maxima"""
+    from analysis.bispectrum import batch_max_bicoherence, sum_frequency_bicoherence
+    from analysis.surrogates import phase_randomize_batch
+    x, y, z = np.random.default_rng(9).standard_normal((3, 2048))
+    X, Y, Z = (phase_randomize_batch(s, 4, seed=k) for k, s in enumerate((x, y, z)))
+    peaks = batch_max_bicoherence(X, Y, Z, 100.0, 128, f1_range=(5.0, 30.0), f2_range=(0.0, 20.0))
+    ref = [cross_bispectrum(X[b], Y[b], Z[b], 100.0, 128, f1_range=(5.0, 30.0), f2_range=(0.0, 20.0))[2].max()
+           for b in range(4)]
+    np.testing.assert_allclose(peaks, ref, rtol=1e-12)
+    line = batch_max_bicoherence(X, Y, Z, 100.0, 128, f3=20.0, halfwidth=1.0)
+    ref = [sum_frequency_bicoherence(X[b], Y[b], Z[b], 20.0, 100.0, 128, halfwidth=1.0)[2].max() for b in range(4)]
+    np.testing.assert_allclose(line, ref, rtol=1e-12)
+
+
+def test_sequential_stops_early_when_clear():
+    """Clear calls stop at min_B; borderline peaks run to the cap"""
+    from analysis.surrogates import sequential_peak_test, peak_zscore
+    rng = np.random.default_rng(0)
+    batches = lambda: (rng.normal(0.5, 0.05, 5) for _ in range(40))
+    assert sequential_peak_test(0.9, batches())[4] == 10
+    assert sequential_peak_test(0.4, batches())[4] == 10
+    assert sequential_peak_test(0.582, batches())[4] == 200
+    null = rng.normal(0.5, 0.05, 10)
+    assert sequential_peak_test(0.9, [null[:5], null[5:]])[:4] == peak_zscore(0.9, null)
+
+
+def test_run_surrogates_worker_invariant():
+    """Per-surrogate SeedSequence streams: same values for any chunk size or worker count"""
+    from analysis.bispectrum import batch_max_bicoherence
+    from analysis.surrogates import run_surrogates
+    sig = np.random.default_rng(5).standard_normal((3, 2048))
+    kw = dict(fs=100.0, seglen=128, f1_range=(5.0, 30.0), f2_range=(0.0, 20.0))
+    ref = np.concatenate(list(run_surrogates(batch_max_bicoherence, sig, 6, seed=3, chunk=4, **kw)))
+    assert ref.shape == (6,)
+    for chunk, workers in ((1, None), (2, 2), (4, 3)):
+        got = np.concatenate(list(run_surrogates(batch_max_bicoherence, sig, 6, seed=3, chunk=chunk,
+                                                 workers=workers, **kw)))
+        np.testing.assert_array_equal(got, ref)
+    other = np.concatenate(list(run_surrogates(batch_max_bicoherence, sig, 6, seed=4, chunk=4, **kw)))
+    assert not np.array_equal(other, ref)
+
+
+def test_iaaft_batch():
+    """IAAFT rows keep the exact values and ~the spectrum, each row stopping on its own"""
+    from analysis.surrogates import iaaft_batch
+    rng = np.random.default_rng(8)
+    x = rng.poisson(3, 4096) + 2.0*np.sin(0.05*np.arange(4096))
+    S, info = iaaft_batch(x, 6, seed=2)
+    np.testing.assert_array_equal(np.sort(S, axis=1), np.broadcast_to(np.sort(x), S.shape))
+    assert info["converged"].all() and (info["n_iter"] < 100).all() and info["seconds"] > 0
+    assert len(set(info["n_iter"])) > 1
+    mag = np.abs(np.fft.rfft(x))
+    err = np.linalg.norm(np.abs(np.fft.rfft(S, axis=1)) - mag, axis=1)/np.linalg.norm(mag)
+    assert (err < 0.01).all()
+    _, capped = iaaft_batch(x, 2, seed=2, max_iter=3)
+    assert (capped["n_iter"] == 3).all() and not capped["converged"].any()
+
+
+def test_evd_tail_from_few_surrogates():
+    """A Gumbel fit to 15 maxima extrapolates the tail p-value of a max statistic"""
+    from analysis.surrogates import evd_peak_test
+    rng = np.random.default_rng(1)
+    draw = lambda n: rng.standard_normal((n, 500)).max(axis=1)
+    ref = (draw(50000) > 4.0).mean()
+    ps = [evd_peak_test(4.0, draw(15))[1] for _ in range(40)]
+    assert 0.5*ref < np.median(ps) < 2*ref
+    z, p, mu, sd, diag = evd_peak_test(4.0, draw(15), dist="gev")
+    assert diag["n"] == 15 and 0 <= diag["ks_p"] <= 1 and diag["ppcc"] > 0.8 and diag["scale"] > 0
+    with pytest.raises(ValueError):
+        evd_peak_test(4.0, draw(15), dist="normal")
+
+
+def test_slice_analytic_counts_every_line():
+    """The sum-line profile is a max over lines: the analytic test sees all (line, f1) bins"""
+    from analysis.bispectrum import sum_frequency_bicoherence
+    x, y, z = np.random.default_rng(4).standard_normal((3, 8192))
+    f1, f3, prof, f3_lines, b2 = sum_frequency_bicoherence(x, y, z, 200.0, 1000.0, 256, halfwidth=8.0, lines=True)
+    assert b2.shape == (5, len(f1))
+    np.testing.assert_array_equal(prof, b2.max(axis=0))
+    grid = analytic_bins(b2.ravel(), (np.tile(f1, 5), np.repeat(f3_lines, len(f1))), 1000.0)
+    assert grid.size > 4 * analytic_bins(prof, (f1, f3), 1000.0).size
+    assert grid.max() == analytic_bins(prof, (f1, f3), 1000.0).max()
+
+
+def test_analytic_degenerate_nseg():
+    """Too few segments give NaN rather than infinite significance; b2 above 1 is clipped"""
+    for nseg in (1, 2, 3):
+        assert np.isnan(analytic_peak_test(1.0 + 1e-12, nseg, 100)[1])
+    with pytest.raises(ValueError):
+        analytic_threshold(2)
+    assert analytic_peak_test(1.0 + 1e-12, 40, 100)[1] == analytic_peak_test(1.0, 40, 100)[1]